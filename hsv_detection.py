@@ -1,45 +1,321 @@
 # hsv_detection.py
 # This module provides a function to detect the center of a specified color in an image using HSV thresholding.
+import threading
 import cv2
 import numpy as np
 
-def detect_color_center(image, lower_hsv, upper_hsv):
+# Numba is optional: when it is available the BGR->HSV conversion and the range test are fused into a single
+# pass over the frame, otherwise we fall back to cv2.cvtColor + cv2.inRange.
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Use OpenCV's transparent API (OpenCL via cv2.UMat) when the build and platform provide an OpenCL device;
+# otherwise detection stays on the CPU
+USE_OPENCL = cv2.ocl.haveOpenCL()
+if USE_OPENCL:
+    cv2.ocl.setUseOpenCL(True)
+
+# Pre-allocated scratch (label) buffers reused across frames, keyed by ((height, width), dtype). Kept per thread,
+# so concurrent detections never share one.
+_buffer_cache = threading.local()
+
+# Coordinate ramps (0, 1, ..., n-1) used for the centroid reduction, keyed by length
+_ramp_cache = {}
+
+# Blobs smaller than this many pixels are treated as noise and ignored for the centroid
+# (roughly what the former 5x5 morphological opening removed)
+MIN_BLOB_AREA = 25
+
+# OpenCV's 8-bit BGR->HSV conversion divides through fixed-point reciprocal tables (12 fractional bits) rather
+# than in floating point; the fused kernel uses the same tables so its mask is identical to cvtColor + inRange
+_HSV_SHIFT = 12
+_HSV_SDIV = np.zeros(256, np.int32)
+_HSV_HDIV = np.zeros(256, np.int32)
+_HSV_SDIV[1:] = np.rint((255 << _HSV_SHIFT) / np.arange(1, 256, dtype=np.float64))
+_HSV_HDIV[1:] = np.rint((180 << _HSV_SHIFT) / (6.0 * np.arange(1, 256, dtype=np.float64)))
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True)
+    def _hsv_threshold(image, lo, hi, out, sdiv, hdiv):
+        rows = image.shape[0]
+        cols = image.shape[1]
+        h_lo, s_lo, v_lo = lo[0], lo[1], lo[2]
+        h_hi, s_hi, v_hi = hi[0], hi[1], hi[2]
+        half = np.int32(1 << (_HSV_SHIFT - 1))
+        for y in numba.prange(rows):
+            for x in range(cols):
+                b = np.int32(image[y, x, 0])
+                g = np.int32(image[y, x, 1])
+                r = np.int32(image[y, x, 2])
+
+                # V is the max channel
+                v = max(b, g, r)
+                out[y, x] = 0
+                if v < v_lo or v > v_hi:
+                    continue
+
+                # S = (V - min) * 255 / V
+                diff = v - min(b, g, r)
+                s = (diff * sdiv[v] + half) >> _HSV_SHIFT
+                if s < s_lo or s > s_hi:
+                    continue
+
+                # H from the max channel (R first, then G), halved to fit into 8 bits
+                if v == r:
+                    h = g - b
+                elif v == g:
+                    h = b - r + 2 * diff
+                else:
+                    h = r - g + 4 * diff
+                h = (h * hdiv[diff] + half) >> _HSV_SHIFT
+                if h < 0:
+                    h += 180
+                if h < h_lo or h > h_hi:
+                    continue
+
+                out[y, x] = 255
+
+    def hsv_threshold(image, lo, hi, out):
+        """
+        Fused BGR->HSV conversion and range test.
+
+        Reads each BGR pixel once, computes H, S, V with OpenCV's 8-bit fixed-point formula (H in [0, 180),
+        S and V in [0, 255]) and writes 255 into `out` when all six bounds hold, 0 otherwise, so the mask
+        matches cv2.cvtColor(COLOR_BGR2HSV) + cv2.inRange pixel for pixel.
+
+        Parameters:
+            image (numpy.ndarray): Input image in BGR format, shape (H, W, 3), dtype uint8.
+            lo (numpy.ndarray): Lower HSV bound (3 values).
+            hi (numpy.ndarray): Upper HSV bound (3 values).
+            out (numpy.ndarray): Output mask, shape (H, W), dtype uint8.
+        """
+        _hsv_threshold(image, lo, hi, out, _HSV_SDIV, _HSV_HDIV)
+
+    @numba.njit(parallel=True, cache=True)
+    def lut_threshold(image, lut, out):
+        """
+        Threshold a BGR image through a precomputed (256, 256, 256) color table: out[y, x] = lut[b, g, r].
+        """
+        rows = image.shape[0]
+        cols = image.shape[1]
+        for y in numba.prange(rows):
+            for x in range(cols):
+                out[y, x] = lut[image[y, x, 0], image[y, x, 1], image[y, x, 2]]
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _mask_moments(mask):
+        """
+        Single pass over a binary mask returning (m00, m10, m01) as pixel counts and coordinate sums.
+
+        Only used by _center_from_mask, i.e. when detect_color_center is called with min_area=0; the default
+        noise-filtered path takes blob centroids from connectedComponentsWithStats instead.
+        """
+        rows = mask.shape[0]
+        cols = mask.shape[1]
+        m00 = 0
+        m10 = 0
+        m01 = 0
+        for y in numba.prange(rows):
+            count = 0
+            x_sum = 0
+            for x in range(cols):
+                if mask[y, x] != 0:
+                    count += 1
+                    x_sum += x
+            m00 += count
+            m10 += x_sum
+            m01 += count * y
+        return m00, m10, m01
+else:
+    hsv_threshold = None
+    lut_threshold = None
+    _mask_moments = None
+
+def _get_buffer(shape, dtype=np.uint8):
+    """Return a cached single-channel buffer of the calling thread for the given (height, width) and dtype."""
+    cache = getattr(_buffer_cache, "buffers", None)
+    if cache is None:
+        cache = _buffer_cache.buffers = {}
+    key = (shape, np.dtype(dtype))
+    buf = cache.get(key)
+    if buf is None:
+        buf = np.empty(shape, dtype)
+        cache[key] = buf
+    return buf
+
+def _get_ramp(length):
+    """Return a cached int64 coordinate ramp of the given length."""
+    ramp = _ramp_cache.get(length)
+    if ramp is None:
+        ramp = np.arange(length, dtype=np.int64)
+        _ramp_cache[length] = ramp
+    return ramp
+
+def _center_from_mask(mask):
+    """
+    Compute the centroid of the white pixels of a binary mask.
+
+    Only the three terms the centroid needs (m00, m10, m01) are computed, instead of the full set of spatial and
+    central moments returned by cv2.moments: in one compiled pass when Numba is available, otherwise from one
+    column-sum and one row-sum reduction. This is the min_area=0 path of detect_color_center; with the default
+    min_area the centroid comes from _blob_centroid.
+
+    Returns:
+        Tuple (x, y) of the centroid, or None if the mask is empty.
     """
-    Detect the centroid of the mask of the specified HSV color range after applying a morphological filter.
-    
+    if _mask_moments is not None:
+        m00, m10, m01 = _mask_moments(mask)
+        if m00 == 0:
+            return None
+        return int(m10 / m00), int(m01 / m00)
+
+    # Sum each column; the total of those sums is m00
+    col_sums = cv2.reduce(mask, 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
+    m00 = int(col_sums.sum())
+    if m00 == 0:
+        return None
+
+    # m10 and m01 are the column/row sums weighted by their coordinate
+    row_sums = cv2.reduce(mask, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
+    m10 = int(np.dot(col_sums, _get_ramp(mask.shape[1])))
+    m01 = int(np.dot(row_sums, _get_ramp(mask.shape[0])))
+    return int(m10 / m00), int(m01 / m00)
+
+def _blob_centroid(mask, min_area):
+    """
+    Compute the centroid of the white pixels of a binary mask, ignoring blobs smaller than min_area pixels.
+
+    A single connected-components pass labels the blobs and gives each blob's area and centroid; the result is
+    the area-weighted mean of the centroids of the blobs that are kept.
+
+    Returns:
+        Tuple (x, y) of the centroid, or None if no blob is large enough.
+    """
+    labels = _get_buffer(mask.shape, np.int32)
+    _, _, stats, centroids = cv2.connectedComponentsWithStats(mask, labels, connectivity=8, ltype=cv2.CV_32S)
+
+    # Label 0 is the background
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    keep = areas >= min_area
+    areas = areas[keep]
+    m00 = int(areas.sum())
+    if m00 == 0:
+        return None
+
+    centroids = centroids[1:][keep]
+    cX = float(np.dot(centroids[:, 0], areas)) / m00
+    cY = float(np.dot(centroids[:, 1], areas)) / m00
+    return int(cX), int(cY)
+
+def build_hsv_lut(lower_hsv, upper_hsv):
+    """
+    Precompute the HSV range test for every BGR color.
+
+    Since the bounds are constant, the mapping (B, G, R) -> {0, 255} is fixed; building it once lets each frame
+    be thresholded with a single table lookup per pixel, with no HSV conversion at all.
+
+    Parameters:
+        lower_hsv (numpy.ndarray): Lower bound for HSV thresholding.
+        upper_hsv (numpy.ndarray): Upper bound for HSV thresholding.
+
+    Returns:
+        numpy.ndarray: (256, 256, 256) uint8 table (16 MiB) indexed [b, g, r], 255 inside the range and 0 outside.
+    """
+    lower_hsv = np.asarray(lower_hsv, dtype=np.uint8)
+    upper_hsv = np.asarray(upper_hsv, dtype=np.uint8)
+    lut = np.empty((256, 256, 256), np.uint8)
+
+    # Convert one 256x256 plane of (g, r) combinations per blue value to keep the temporary buffers small
+    levels = np.arange(256, dtype=np.uint8)
+    plane = np.empty((256, 256, 3), np.uint8)
+    plane[:, :, 1] = levels[:, None]
+    plane[:, :, 2] = levels[None, :]
+    for b in range(256):
+        plane[:, :, 0] = b
+        hsv_plane = cv2.cvtColor(plane, cv2.COLOR_BGR2HSV)
+        lut[b] = cv2.inRange(hsv_plane, lower_hsv, upper_hsv)
+    return lut
+
+def _detect_color_center_ocl(image, lower_hsv, upper_hsv, min_area):
+    """
+    OpenCL variant of detect_color_center: conversion and thresholding run on the OpenCL device. Returns the same
+    (center, mask) tuple, with the mask downloaded to host memory.
+    """
+    hsv_img = cv2.cvtColor(cv2.UMat(image), cv2.COLOR_BGR2HSV)
+    # The mask is returned on the host anyway, so the centroid is computed there with the same helpers as the
+    # CPU path (connected components have no OpenCL implementation, and cv2.moments computes every moment up to
+    # third order when only three are needed)
+    mask = cv2.inRange(hsv_img, lower_hsv, upper_hsv).get()
+
+    if min_area > 0:
+        return _blob_centroid(mask, min_area), mask
+    return _center_from_mask(mask), mask
+
+def detect_color_center(image, lower_hsv, upper_hsv, hsv_buf=None, mask_buf=None, min_area=MIN_BLOB_AREA,
+                        lut=None):
+    """
+    Detect the centroid of the mask of the specified HSV color range, ignoring small noise blobs.
+
     This function first converts the input BGR image to HSV, thresholds the image to create a binary mask for the
-    specified HSV range, applies a morphological opening filter to remove noise, and then computes the centroid (center of mass)
-    of the resulting mask.
-    
+    specified HSV range, and then computes the centroid (center of mass) of the mask. Noise is rejected by
+    dropping connected blobs smaller than min_area pixels instead of running a morphological filter over the
+    whole frame. When an OpenCL device is available (USE_OPENCL) the per-pixel work runs there; otherwise, when
+    Numba is available, the conversion and thresholding run as a single fused kernel on the CPU. When a table from
+    build_hsv_lut is passed, thresholding is a single lookup per pixel and the HSV conversion is skipped entirely.
+
     Parameters:
         image (numpy.ndarray): Input image in BGR format.
         lower_hsv (numpy.ndarray): Lower bound for HSV thresholding.
         upper_hsv (numpy.ndarray): Upper bound for HSV thresholding.
-        
+        hsv_buf (numpy.ndarray, optional): Pre-allocated (H, W, 3) uint8 buffer for the HSV image (CPU path only).
+        mask_buf (numpy.ndarray, optional): Pre-allocated (H, W) uint8 buffer the mask is written into (CPU path only);
+            without it a new mask array is allocated per call.
+        min_area (int, optional): Minimum blob area in pixels; 0 disables the noise filter.
+        lut (numpy.ndarray, optional): Table from build_hsv_lut(lower_hsv, upper_hsv); always runs on the CPU.
+
     Returns:
         tuple: (center, mask)
             center: Tuple (x, y) representing the centroid of the mask, or None if the mask is empty.
-            mask: The binary mask image after thresholding and morphological filtering.
+            mask: The binary mask image after thresholding (small blobs are not removed from it); this is mask_buf
+                when one was passed, otherwise a new array owned by the caller.
     """
     import cv2
     import numpy as np
 
-    # Convert the image from BGR to HSV color space
-    hsv_img = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    
-    # Create a binary mask with the given HSV range
-    mask = cv2.inRange(hsv_img, lower_hsv, upper_hsv)
-    
-    # Apply a morphological opening filter to remove small noise
-    kernel = np.ones((5, 5), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-    
-    # Compute moments of the mask to get the centroid of all white pixels
-    M = cv2.moments(mask)
-    if M["m00"] != 0:
-        cX = int(M["m10"] / M["m00"])
-        cY = int(M["m01"] / M["m00"])
-        return (cX, cY), mask
+    # OpenCV dispatches to its vectorized 8-bit kernels only for contiguous uint8 data; these are no-ops when the
+    # caller already passes uint8 bounds and a contiguous frame
+    image = np.ascontiguousarray(image)
+    lower_hsv = np.asarray(lower_hsv, dtype=np.uint8)
+    upper_hsv = np.asarray(upper_hsv, dtype=np.uint8)
+
+    if USE_OPENCL and lut is None:
+        return _detect_color_center_ocl(image, lower_hsv, upper_hsv, min_area)
+
+    if mask_buf is None:
+        # The mask is returned to the caller, so without a caller-owned buffer it has to be a fresh array
+        mask_buf = np.empty(image.shape[:2], np.uint8)
+
+    if lut is not None:
+        # One table lookup per pixel, no HSV conversion
+        if lut_threshold is not None:
+            lut_threshold(image, lut, mask_buf)
+        else:
+            mask_buf[...] = lut[image[:, :, 0], image[:, :, 1], image[:, :, 2]]
+    elif hsv_threshold is not None:
+        # Threshold straight from BGR into the mask buffer, skipping the intermediate HSV image
+        hsv_threshold(image, lower_hsv, upper_hsv, mask_buf)
     else:
-        # If no white pixels are found, return None for the center
-        return None, mask
+        # Convert the image from BGR to HSV color space
+        hsv_img = cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=hsv_buf)
+
+        # Create a binary mask with the given HSV range
+        cv2.inRange(hsv_img, lower_hsv, upper_hsv, dst=mask_buf)
+
+    if min_area > 0:
+        # Centroid of the blobs large enough not to be noise
+        return _blob_centroid(mask_buf, min_area), mask_buf
+
+    # Compute the centroid of all white pixels (None if no white pixels are found)
+    return _center_from_mask(mask_buf), mask_buf
@@ -2,13 +2,21 @@
 Modbus Connection Module
 
 This module uses pymodbus to open a serial RTU connection.
+Socket options such as TCP_NODELAY do not apply to the serial link; serial latency is governed by the
+baud rate, the request timeout and the USB adapter. On connect the port is switched to low-latency mode
+where the platform supports it (see tune_serial_port), including lowering the FTDI latency timer.
+ModbusConnection is the blocking client used from threads; AsyncModbusConnection offers the same
+operations as coroutines for code running on an asyncio event loop.
 Install pymodbus with:
     pip install pymodbus
 """
 
 import logging
+import os
+import time
 import serial
 from pymodbus.client.serial import ModbusSerialClient as ModbusClient
+from pymodbus.client.serial import AsyncModbusSerialClient
 from pymodbus.transaction import ModbusRtuFramer
 
 # Debug flag to control pymodbus logging verbosity
@@ -17,10 +25,84 @@ DEBUG = True  # Set to True to enable detailed pymodbus logging
 # Set default logging to INFO level instead of DEBUG
 logging.basicConfig(level=logging.INFO)
 
+# Protocol limits on the number of registers per request
+MAX_READ_COUNT = 125   # FC03 Read Holding Registers
+MAX_WRITE_COUNT = 123  # FC16 Write Multiple Registers
+
+# Driver receive/transmit buffer size requested on platforms that support it (Windows)
+SERIAL_BUFFER_SIZE = 4096
+# FTDI USB adapters hold received bytes for up to this many milliseconds before passing them to the host.
+# The driver default of 16 ms dominates an RTU round-trip at 115200 baud.
+FTDI_LATENCY_TIMER_MS = 1
+
+def set_usb_latency_timer(port: str, latency_ms: int = FTDI_LATENCY_TIMER_MS) -> bool:
+    """
+    Lower the latency timer of a USB serial adapter through sysfs (Linux, FTDI and compatible drivers).
+    
+    Args:
+        port: Serial port, e.g. /dev/ttyUSB0 or a /dev/serial/by-id/ link to it
+        latency_ms: Latency timer in milliseconds
+        
+    Returns:
+        True if the timer was set; False if the adapter has no latency timer or it isn't writable
+    """
+    device = os.path.basename(os.path.realpath(port))
+    path = f"/sys/bus/usb-serial/devices/{device}/latency_timer"
+    try:
+        with open(path, "w") as f:
+            f.write(str(latency_ms))
+    except FileNotFoundError:
+        return False  # Not Linux, or not an FTDI-style adapter
+    except OSError as e:
+        logging.warning(f"Could not set USB latency timer {path} (needs write access, e.g. a udev rule): {e}")
+        return False
+    logging.info(f"Set USB latency timer of {device} to {latency_ms} ms")
+    return True
+
+def tune_serial_port(ser, port: str, inter_byte_timeout: float = None):
+    """
+    Apply low-latency settings to an open pyserial port. Each setting is skipped where the platform or
+    driver doesn't support it.
+    
+    Args:
+        ser: Open serial.Serial instance
+        port: Serial port name, used to find the adapter's latency timer
+        inter_byte_timeout: Seconds of silence after which a read returns early; None leaves reads bounded
+            by the request timeout only
+    """
+    if hasattr(ser, "set_buffer_size"):
+        try:
+            ser.set_buffer_size(rx_size=SERIAL_BUFFER_SIZE, tx_size=SERIAL_BUFFER_SIZE)
+        except (ValueError, serial.SerialException) as e:
+            logging.debug(f"Could not set serial buffer size: {e}")
+    if hasattr(ser, "set_low_latency_mode"):
+        try:
+            ser.set_low_latency_mode(True)
+        except (ValueError, OSError) as e:
+            logging.debug(f"Could not enable serial low-latency mode: {e}")
+    if inter_byte_timeout is not None:
+        ser.inter_byte_timeout = inter_byte_timeout
+    set_usb_latency_timer(port)
+
 class ModbusConnection:
-    def __init__(self, port: str, baudrate: int = 9600):
+    def __init__(self, port: str, baudrate: int = 115200, timeout: float = 0.1, retries: int = 0,
+                 low_latency: bool = True, inter_byte_timeout: float = None):
+        """
+        Args:
+            port: Serial port of the RTU bus (e.g. /dev/ttyUSB0)
+            baudrate: Bus speed; must match the slave configuration (default: 115200)
+            timeout: Seconds to wait for a response before a request fails (default: 0.1)
+            retries: Retries after a failed request; 0 fails fast on known-online hardware (default: 0)
+            low_latency: Apply tune_serial_port to the port on connect (default: True)
+            inter_byte_timeout: Passed to tune_serial_port; keep it well above the USB adapter's latency timer
+                or replies may be cut short (default: None)
+        """
         self.port = port
         self.baudrate = baudrate
+        self.timeout = timeout
+        self.retries = retries
+        self.low_latency = low_latency
+        self.inter_byte_timeout = inter_byte_timeout
         
         # Configure pymodbus logging based on DEBUG flag
         from pymodbus import pymodbus_apply_logging_config
@@ -38,9 +120,16 @@ class ModbusConnection:
             baudrate=baudrate,
             parity='N',
             stopbits=1,
-            bytesize=8
+            bytesize=8,
+            timeout=timeout,
+            retries=retries
         )
         self._connected = False
+        
+        # is_connected() reuses the result of a successful probe for this many seconds
+        # instead of doing an RTU round-trip on every call
+        self.health_ttl = 1.0
+        self._last_ok_ts = 0.0
 
     def connect(self) -> bool:
         """Connect to the Modbus device"""
@@ -70,6 +159,9 @@ class ModbusConnection:
                 if connect_result:
                     self._connected = True
                     logging.info(f"Successfully connected to Modbus RTU bus on port {self.port}")
+                    ser = getattr(self.client, "socket", None)
+                    if self.low_latency and ser is not None:
+                        tune_serial_port(ser, self.port, self.inter_byte_timeout)
                     return True
                 else:
                     # Get more information about why connect failed
@@ -93,6 +185,7 @@ class ModbusConnection:
                 
             self.client.close()
             self._connected = False
+            self._last_ok_ts = 0.0
             logging.info("Modbus connection closed")
             return True
         except Exception as e:
@@ -104,12 +197,17 @@ class ModbusConnection:
         try:
             if not self._connected:
                 return False
+            
+            # A recent successful probe is still trusted
+            if time.monotonic() - self._last_ok_ts < self.health_ttl:
+                return True
                 
             # Simple read from slave ID 1
             result = self.client.read_holding_registers(0, 1, slave=1)
 
             if result and not result.isError():
                 logging.info("Successfully communicated with device")
+                self._last_ok_ts = time.monotonic()
                 return True
             else:
                 logging.error("No response from device")
@@ -153,4 +251,199 @@ class ModbusConnection:
             return False
             
         result = self.client.write_register(address, value, slave=slave_id)
-        return result.isError()
\ No newline at end of file
+        return not result.isError()
+
+    def read_register_range(self, address: int, count: int, slave_id: int):
+        """Read a register range of any length in as few FC03 requests as the protocol allows"""
+        registers = []
+        for start in range(address, address + count, MAX_READ_COUNT):
+            chunk = self.read_registers(start, min(MAX_READ_COUNT, address + count - start), slave_id)
+            if chunk is None:
+                return None
+            registers.extend(chunk)
+        return registers
+
+    def batch(self, slave_id: int):
+        """Create a RegisterWriteBatch that accumulates single-register writes for one slave"""
+        return RegisterWriteBatch(self, slave_id)
+
+
+class RegisterWriteBatch:
+    """
+    Accumulates single-register writes and flushes them as FC16 Write Multiple Registers requests,
+    one per run of contiguous addresses, instead of one FC06 round-trip per register.
+    
+    Writes are flushed when flush() is called, when the batch is used as a context manager and the block exits,
+    or when a contiguous run would exceed the protocol limit. Staged writes go out in address order, not the
+    order they were staged, and a later write to a staged address replaces the earlier value; callers whose
+    writes have side effects that depend on order must flush before staging a lower or repeated address.
+    
+    Usage:
+        with connection.batch(slave_id=1) as batch:
+            batch.write(4, 1)
+            batch.write(5, 1)
+    """
+    
+    def __init__(self, connection: ModbusConnection, slave_id: int):
+        self.connection = connection
+        self.slave_id = slave_id
+        self._pending = {}
+
+    def write(self, address: int, value: int):
+        """Stage a register write; a later write to the same address replaces the earlier one"""
+        self._pending[address] = value
+        if len(self._pending) >= MAX_WRITE_COUNT:
+            self.flush()
+
+    def flush(self) -> bool:
+        """Write all staged registers, returning True if every request succeeded"""
+        if not self._pending:
+            return True
+            
+        pending, self._pending = self._pending, {}
+        success = True
+        start = None
+        values = []
+        for address in sorted(pending):
+            if start is not None and address != start + len(values):
+                success &= self.connection.write_registers(start, values, self.slave_id)
+                start = None
+            if start is None:
+                start = address
+                values = []
+            values.append(pending[address])
+        success &= self.connection.write_registers(start, values, self.slave_id)
+        return success
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+
+class AsyncModbusConnection:
+    """
+    asyncio counterpart of ModbusConnection.
+    
+    Requests are awaited instead of blocking the calling thread, so Modbus I/O can be interleaved with other
+    coroutines (e.g. MQTT publishing) on a single event loop.
+    """
+    
+    def __init__(self, port: str, baudrate: int = 115200, timeout: float = 0.1, retries: int = 0,
+                 low_latency: bool = True):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.retries = retries
+        # The asyncio transport owns the serial object, so only the adapter's latency timer is tuned
+        self.low_latency = low_latency
+        
+        self.client = AsyncModbusSerialClient(
+            port=port,
+            framer=ModbusRtuFramer,
+            baudrate=baudrate,
+            parity='N',
+            stopbits=1,
+            bytesize=8,
+            timeout=timeout,
+            retries=retries
+        )
+        self._connected = False
+        
+        # is_connected() reuses the result of a successful probe for this many seconds
+        self.health_ttl = 1.0
+        self._last_ok_ts = 0.0
+
+    async def connect(self) -> bool:
+        """Connect to the Modbus device"""
+        if self._connected:
+            logging.info("Already connected to Modbus device")
+            return True
+            
+        logging.info(f"Attempting to connect to port {self.port} with baudrate {self.baudrate}")
+        try:
+            await self.client.connect()
+        except Exception as e:
+            logging.error(f"Exception during Modbus connect: {str(e)}")
+            return False
+            
+        self._connected = bool(self.client.connected)
+        if self._connected:
+            logging.info(f"Successfully connected to Modbus RTU bus on port {self.port}")
+            if self.low_latency:
+                set_usb_latency_timer(self.port)
+        else:
+            logging.error(f"Failed to connect to Modbus RTU bus on port {self.port}")
+        return self._connected
+
+    def disconnect(self) -> bool:
+        """Disconnect from the Modbus device"""
+        try:
+            if not self._connected:
+                return True
+                
+            self.client.close()
+            self._connected = False
+            self._last_ok_ts = 0.0
+            logging.info("Modbus connection closed")
+            return True
+        except Exception as e:
+            logging.error(f"Error disconnecting from Modbus device: {e}")
+            return False
+
+    async def is_connected(self) -> bool:
+        """Check if connected to Modbus device"""
+        if not self._connected:
+            return False
+        if time.monotonic() - self._last_ok_ts < self.health_ttl:
+            return True
+            
+        try:
+            result = await self.client.read_holding_registers(0, 1, slave=1)
+        except Exception as e:
+            logging.error(f"Error checking connection: {str(e)}")
+            self._connected = False
+            return False
+            
+        if result and not result.isError():
+            self._last_ok_ts = time.monotonic()
+            return True
+        logging.error("No response from device")
+        self._connected = False
+        return False
+
+    async def read_registers(self, address: int, count: int, slave_id: int):
+        if not self._connected:
+            logging.error("Not connected to Modbus device")
+            return None
+            
+        result = await self.client.read_holding_registers(address, count, slave=slave_id)
+        if not result.isError():
+            logging.debug(f"Slave {slave_id}: Read registers at {hex(address)}: {result.registers}")
+            return result.registers
+        else:
+            logging.error(f"Slave {slave_id}: Error reading registers at {hex(address)}")
+            return None
+
+    async def write_registers(self, address: int, values: list, slave_id: int):
+        if not self._connected:
+            logging.error("Not connected to Modbus device")
+            return False
+            
+        result = await self.client.write_registers(address, values, slave=slave_id)
+        if not result.isError():
+            logging.debug(f"Slave {slave_id}: Wrote {values} starting at {hex(address)}")
+            return True
+        else:
+            logging.error(f"Slave {slave_id}: Error writing registers at {hex(address)}")
+            return False
+
+    async def write_register(self, address: int, value: int, slave_id: int):
+        if not self._connected:
+            logging.error("Not connected to Modbus device")
+            return False
+            
+        result = await self.client.write_register(address, value, slave=slave_id)
+        return not result.isError()
@@ -3,12 +3,17 @@
 # and sends the coordinate via MQTT.
 
 import cv2
+import os
+import platform
+import queue
+import threading
 import time
 import numpy as np
 import paho.mqtt.client as mqtt
-from picamera2 import Picamera2
-from hsv_detection import detect_color_center  # Import the common color detection function
+from picamera2 import Picamera2, MappedArray
+from hsv_detection import detect_color_center, build_hsv_lut  # Import the common color detection functions
 import json
+import struct
 
 # MQTT configuration parameters
 MQTT_BROKER = "localhost"  # Change to your MQTT broker address if needed
@@ -16,26 +21,148 @@ MQTT_PORT = 1883
 MQTT_TOPIC = "color/center"
 motorSpeedTopic = "stepper/stepper1/axis/0/servo_speed"
 
-def send_mqtt_message(client, topic, message):
+# Binary layout of the center payload: two little-endian int32 (x, y); (-1, -1) means no color detected.
+# Must match CENTER_FORMAT in mqtt_listener.py
+CENTER_FORMAT = "<ii"
+NO_CENTER = (-1, -1)
+
+# Show the camera and mask windows (debugging only; costs a GUI upload of every frame)
+DEBUG_DISPLAY = False
+
+# Camera stream sizes (width, height): the main stream is only used for display, detection runs on the
+# smaller YUV420 "lores" stream
+CAMERA_SIZE = (1280, 720)
+LORES_SIZE = (640, 360)
+# Factor mapping lores coordinates back onto the main stream
+LORES_SCALE = (CAMERA_SIZE[0] / LORES_SIZE[0], CAMERA_SIZE[1] / LORES_SIZE[1])
+# Number of camera buffers, so the sensor can keep filling one while another is being processed
+CAMERA_BUFFER_COUNT = 3
+# Minimum time in seconds between processed frames (0 processes every frame the camera delivers)
+FRAME_INTERVAL = 1.0
+# Completed requests waiting for detection; when full, the oldest is dropped to keep latency bounded
+FRAME_QUEUE_SIZE = 2
+# CPU the capture thread is pinned to; detection (and OpenCV's worker threads) run on the remaining cores
+CAPTURE_CPU = 0
+
+def send_mqtt_message(client, topic, message, qos=0):
     """
     Publish a message to the specified MQTT topic.
     
     Parameters:
         client: MQTT client instance.
         topic (str): The MQTT topic to publish to.
-        message (str): The message payload.
+        message (bytes or str): The message payload.
+        qos (int): MQTT quality of service (0 = fire and forget, no broker acknowledgement to wait for).
+    """
+    client.publish(topic, message, qos=qos, retain=False)
+
+class CenterPublisher:
+    """
+    Publish the detected color center as a packed binary payload, but only when it changes.
+    """
+    
+    def __init__(self, client, topic=MQTT_TOPIC):
+        self.client = client
+        self.topic = topic
+        self._packer = struct.Struct(CENTER_FORMAT)
+        self._last = None
+    
+    def publish(self, center):
+        """
+        Publish the center if it differs from the last one sent.
+        
+        Parameters:
+            center: Tuple (x, y), or None if no color was detected.
+            
+        Returns:
+            bool: True if a message was published.
+        """
+        if center is None:
+            center = NO_CENTER
+        if center == self._last:
+            return False
+        self._last = center
+        send_mqtt_message(self.client, self.topic, self._packer.pack(*center))
+        return True
+
+def pin_current_thread(cpus):
+    """
+    Pin the calling thread to the given CPUs. No-op where sched_setaffinity is unavailable.
+    
+    Parameters:
+        cpus (set): CPU indices the thread may run on.
     """
-    client.publish(topic, message)
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    # On Linux pid 0 refers to the calling thread
+    cpus = set(cpus) & os.sched_getaffinity(0)
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+def configure_opencv(num_threads):
+    """
+    Enable OpenCV's optimized (SIMD) code paths and size its thread pool.
+    
+    Parameters:
+        num_threads (int): Number of worker threads OpenCV may use for cvtColor, inRange, etc.
+    """
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(num_threads)
+    
+    # On the Pi the vectorized kernels are only there if the installed wheel was built with NEON
+    if platform.machine().startswith(("arm", "aarch64")) and "NEON" not in cv2.getBuildInformation():
+        print("Warning: OpenCV was built without NEON support, image processing will be slower")
+
+def capture_frames(picam2, frames, stop_event):
+    """
+    Capture thread: hand completed camera requests to the detection loop through a bounded queue.
+    
+    Requests arriving before the next FRAME_INTERVAL slot are released straight away. When the queue is full
+    the oldest request is released, so detection always works on the newest frame.
+    
+    Parameters:
+        picam2: Started Picamera2 instance.
+        frames (queue.Queue): Bounded queue of completed requests.
+        stop_event (threading.Event): Set to stop capturing.
+    """
+    pin_current_thread({CAPTURE_CPU})
+    next_frame_time = time.monotonic()
+    while not stop_event.is_set():
+        # Wait for the next completed request; the camera keeps filling its other buffers meanwhile
+        request = picam2.capture_request()
+        
+        # Frames arriving before the next processing slot are handed straight back to the camera
+        now = time.monotonic()
+        if now < next_frame_time:
+            request.release()
+            continue
+        next_frame_time = now + FRAME_INTERVAL
+        
+        try:
+            frames.put_nowait(request)
+        except queue.Full:
+            # Drop the oldest frame (returning its buffer to the camera) to make room
+            try:
+                frames.get_nowait().release()
+            except queue.Empty:
+                pass
+            frames.put_nowait(request)
 
 def main():
     # Setup MQTT client and connect to the broker
     client = mqtt.Client()
     client.connect(MQTT_BROKER, MQTT_PORT, 60)
+    # Run the network loop in a background thread so publishing never blocks the capture loop
+    client.loop_start()
+    center_publisher = CenterPublisher(client)
     
     # Setup the camera using Picamera2
     picam2 = Picamera2()
-    # Create a preview configuration for the camera
-    config = picam2.create_preview_configuration()
+    # Create a video configuration for the camera. Picamera2's "RGB888" format is laid out as [B, G, R]
+    # per pixel, which is the channel order OpenCV expects. The lores stream must be YUV420 on the Pi.
+    config = picam2.create_video_configuration(main={"format": "RGB888", "size": CAMERA_SIZE},
+                                               lores={"format": "YUV420", "size": LORES_SIZE},
+                                               buffer_count=CAMERA_BUFFER_COUNT)
     picam2.configure(config)
     picam2.start()
     
@@ -51,42 +178,71 @@ def main():
 
     
     # Define the HSV color range (example values, adjust according to target color)
-    lower_hsv = np.array([140, 90, 120])  # e.g., lower bound for red color
-    upper_hsv = np.array([159, 150, 186])    # e.g., upper bound for red color
+    lower_hsv = np.array([140, 90, 120], dtype=np.uint8)  # e.g., lower bound for red color
+    upper_hsv = np.array([159, 150, 186], dtype=np.uint8)    # e.g., upper bound for red color
+    # The bounds are fixed, so precompute the BGR -> mask table once
+    hsv_lut = build_hsv_lut(lower_hsv, upper_hsv)
+    
+    # Frame buffers for the lores stream, allocated once since its size is fixed at configure time
+    lores_width, lores_height = LORES_SIZE
+    bgr_buf = np.empty((lores_height, lores_width, 3), np.uint8)
+    mask_buf = np.empty((lores_height, lores_width), np.uint8)
+    
+    # Test speed payload, serialized once
+    motorSpeed = json.dumps({'speed': 1000})
+    
+    # Capture runs on its own thread and core; detection runs here on the others
+    frames = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
+    stop_event = threading.Event()
+    capture_thread = threading.Thread(target=capture_frames, args=(picam2, frames, stop_event), daemon=True)
+    capture_thread.start()
+    detection_cpus = set(range(os.cpu_count() or 1)) - {CAPTURE_CPU}
+    pin_current_thread(detection_cpus)
+    configure_opencv(max(1, len(detection_cpus)))
     
     try:
         while True:
-            # Capture an image from the camera
-            image = picam2.capture_array()
-            # Convert image from RGB (Picamera2 default) to BGR for OpenCV processing
-            current_image = image.copy()
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            
-            # Detect the color center using the shared function
-            center, mask = detect_color_center(image, lower_hsv, upper_hsv)
-            
-            # Send a test speed
-            
-            motorSpeed = json.dumps({'speed': 1000})
-            send_mqtt_message(client, motorSpeedTopic, motorSpeed)
-            
-            #if center:
-            #    print("Detected center at:", center)
-                # Send the detected center via MQTT as a string
-            #    send_mqtt_message(client, MQTT_TOPIC, str(center))
-            #else:
-            #    print("No color detected")
-            #    send_mqtt_message(client, MQTT_TOPIC, str((-1,-1)))
+            request = frames.get()
+            try:
+                # Map the lores buffer in place and convert its I420 planes to BGR (4x less data than main)
+                with MappedArray(request, "lores") as m:
+                    yuv = m.array
+                    cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420, dst=bgr_buf)
+                
+                # Detect the color center using the shared function
+                center, mask = detect_color_center(bgr_buf, lower_hsv, upper_hsv, mask_buf=mask_buf, lut=hsv_lut)
+                if center:
+                    # Scale the centroid back to main-stream coordinates
+                    center = (int(center[0] * LORES_SCALE[0]), int(center[1] * LORES_SCALE[1]))
+                
+                # Send a test speed
+                send_mqtt_message(client, motorSpeedTopic, motorSpeed)
+                
+                # Send the detected center via MQTT (only when it moved)
+                center_publisher.publish(center)
 
-            cv2.imshow("Video", current_image)
-            cv2.imshow("Mask", mask)
-            
-            # Delay before next frame capture
-            time.sleep(1)
+                if DEBUG_DISPLAY:
+                    # The main stream is only mapped for display
+                    with MappedArray(request, "main") as m:
+                        cv2.imshow("Video", m.array)
+                    cv2.imshow("Mask", mask)
+                    cv2.waitKey(1)
+            finally:
+                # Return the buffer to the camera so it can be refilled
+                request.release()
     except KeyboardInterrupt:
         print("Exiting program.")
     finally:
+        stop_event.set()
+        capture_thread.join(timeout=1.0)
+        # Hand any frames still queued back to the camera
+        while True:
+            try:
+                frames.get_nowait().release()
+            except queue.Empty:
+                break
         picam2.stop()
+        client.loop_stop()
         client.disconnect()
 
 if __name__ == '__main__':
@@ -1,3 +1,4 @@
+import struct
 import paho.mqtt.client as mqtt
 
 # MQTT configuration parameters
@@ -6,12 +7,26 @@ MQTT_PORT = 1883
 MQTT_TOPIC = "color/center"
 MQTT_TOPIC2 = "stepper/stepper1/axis/0/servo_speed"
 
+# Binary layout of the center payload published by mqtt_camera_color_detection.py
+CENTER_FORMAT = "<ii"
+center_struct = struct.Struct(CENTER_FORMAT)
+
 def on_connect(client, userdata, flags, rc):
     print("Connected with result code", rc)
-    # Subscribe to the topic once connected
+    # Subscribe to the topics once connected
+    client.subscribe(MQTT_TOPIC)
     client.subscribe(MQTT_TOPIC2)
 
 def on_message(client, userdata, msg):
+    if msg.topic == MQTT_TOPIC:
+        # Center payloads are packed binary, (-1, -1) means no color detected. Anything else (e.g. a stale retained
+        # JSON center or a stray publish) is reported instead of raising inside paho's callback.
+        if len(msg.payload) != center_struct.size:
+            print(f"Ignoring malformed center payload {msg.payload!r} on topic: {msg.topic}")
+            return
+        center = center_struct.unpack(msg.payload)
+        print(f"Received center: {center} on topic: {msg.topic}")
+        return
     print(f"Received message: {msg.payload.decode()} on topic: {msg.topic}")
 
 def main():
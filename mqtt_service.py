@@ -18,9 +18,9 @@ Handles MQTT client operations including connecting, publishing, and subscribing
 
 #### Methods
 - `__init__(self, broker_host, broker_port)`: Initialize the client with broker details.
-- `connect(self)`: Connect to the MQTT broker.
+- `connect(self)`: Connect to the MQTT broker. The socket is opened with TCP_NODELAY so small messages go out immediately.
 - `disconnect(self)`: Disconnect from the MQTT broker.
-- `publish(self, topic, message)`: Publish a message to a specific topic.
+- `publish(self, topic, message, qos=0, retain=False)`: Publish a message to a specific topic.
 - `subscribe(self, topic, callback)`: Subscribe to a topic with a callback function.
 
 ### MQTTService
@@ -30,7 +30,7 @@ Combines broker and client management for a complete MQTT service.
 - `__init__(self, host="localhost", port=1883)`: Initialize the service.
 - `start(self)`: Start the broker and connect the client.
 - `stop(self)`: Stop the client and broker.
-- `publish(self, topic, message)`: Publish a message using the client.
+- `publish(self, topic, message, qos=0, retain=False)`: Publish a message using the client.
 - `subscribe(self, topic, callback)`: Subscribe to a topic using the client.
 
 ## Usage Example
@@ -39,11 +39,20 @@ Combines broker and client management for a complete MQTT service.
 import asyncio
 from mqtt_service import MQTTService
 
-async def publish_time(mqtt_service):
+async def publish_time(mqtt_service, interval=1.0):
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
     while True:
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         mqtt_service.publish("time/current", current_time)
-        await asyncio.sleep(1)
+        
+        # If the loop woke up late and missed ticks, the publish above stands in for all of them
+        # instead of firing a burst of catch-up publishes
+        next_tick += interval
+        now = loop.time()
+        if now > next_tick:
+            next_tick = now + interval
+        await asyncio.sleep(next_tick - now)
 
 def time_callback(client, userdata, message):
     print(f"Current time: {message.payload.decode()}")
@@ -75,11 +84,19 @@ Error handling and reconnection logic may need to be implemented for production
 # TODO: Add error handling and reconnection logic for production use
 
 import asyncio
+import socket
 import subprocess
 import time
 from datetime import datetime
 from paho.mqtt import client as mqtt_client
 
+# Client-side publish queue sizing, so bursts of publishes queue up instead of stalling on the in-flight window
+MAX_INFLIGHT_MESSAGES = 200
+MAX_QUEUED_MESSAGES = 10000
+# Automatic reconnect backoff in seconds (paho doubles the delay after each failed attempt up to the maximum)
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 8
+
 class MQTTBroker:
     def __init__(self, host="localhost", port=1883):
         self.host = host
@@ -115,6 +132,12 @@ class MQTTClient:
         self.client = mqtt_client.Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.client.on_socket_open = self.on_socket_open
+        self.client.max_inflight_messages_set(MAX_INFLIGHT_MESSAGES)
+        self.client.max_queued_messages_set(MAX_QUEUED_MESSAGES)
+        self.client.reconnect_delay_set(min_delay=RECONNECT_MIN_DELAY, max_delay=RECONNECT_MAX_DELAY)
+        # Topic filters to restore after a reconnect; the broker drops them with the clean session
+        self._subscriptions = []
 
     def connect(self):
         self.client.connect(self.broker_host, self.broker_port)
@@ -127,17 +150,28 @@ class MQTTClient:
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print("Connected to MQTT Broker!")
+            for topic in self._subscriptions:
+                client.subscribe(topic)
         else:
             print(f"Failed to connect, return code {rc}")
 
+    def on_socket_open(self, client, userdata, sock):
+        # Small publishes (acks, state) are latency-sensitive; don't let Nagle hold them back waiting for more data
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError):
+            # Not a plain TCP socket (e.g. a websocket wrapper)
+            pass
+
     def on_message(self, client, userdata, msg):
         print(f"Received message on topic {msg.topic}: {msg.payload.decode()}")
 
-    def publish(self, topic, message):
-        self.client.publish(topic, message)
-        print(f"Published to {topic}: {message}")
+    def publish(self, topic, message, qos=0, retain=False):
+        # Hands the packet to the network thread started in connect(); no console I/O on this hot path
+        self.client.publish(topic, message, qos=qos, retain=retain)
 
     def subscribe(self, topic, callback):
+        self._subscriptions.append(topic)
         self.client.subscribe(topic)
         self.client.message_callback_add(topic, callback)
 
@@ -159,19 +193,28 @@ class MQTTService:
             self.client.disconnect()
         print("MQTT Service stopped")
 
-    def publish(self, topic, message):
+    def publish(self, topic, message, qos=0, retain=False):
         if self.client:
-            self.client.publish(topic, message)
+            self.client.publish(topic, message, qos=qos, retain=retain)
 
     def subscribe(self, topic, callback):
         if self.client:
             self.client.subscribe(topic, callback)
 
-async def publish_time(mqtt_service):
+async def publish_time(mqtt_service, interval=1.0):
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
     while True:
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         mqtt_service.publish("time/current", current_time)
-        await asyncio.sleep(1)
+        
+        # If the loop woke up late and missed ticks, the publish above stands in for all of them
+        # instead of firing a burst of catch-up publishes
+        next_tick += interval
+        now = loop.time()
+        if now > next_tick:
+            next_tick = now + interval
+        await asyncio.sleep(next_tick - now)
 
 def time_callback(client, userdata, message):
     print(f"Current time: {message.payload.decode()}")
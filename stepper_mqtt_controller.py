@@ -1,9 +1,16 @@
 import json
+import queue
+import re
+import signal
+import struct
 import time
 import threading
+import zlib
+from concurrent.futures import Future
 import logging
 import sys
 import os
+from typing import Final
 
 # Add the parent directory to the path to make imports work
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -13,6 +20,521 @@ from modbus_connection import ModbusConnection
 
 logger = logging.getLogger(__name__)
 
+# JSON codec for MQTT payloads: prefer orjson (C encoder/decoder), then ujson, then the standard library.
+# _dumps always returns bytes, which paho accepts as a payload as-is; _loads accepts bytes directly.
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+
+        def _dumps(obj):
+            return ujson.dumps(obj).encode()
+        _loads = ujson.loads
+    except ImportError:
+        def _dumps(obj):
+            return json.dumps(obj, separators=(",", ":")).encode()
+        _loads = json.loads
+
+# Register map of the polled block
+STATUS_REG: Final[int] = 0x0D           # Status register for both axes
+AXIS0_POSITION_REG: Final[int] = 0x11   # Axis 0 position registers (2 words)
+AXIS1_POSITION_REG: Final[int] = 0x13   # Axis 1 position registers (2 words)
+
+# Status and positions are read as one block starting at the status register
+STATE_REG_COUNT: Final[int] = AXIS1_POSITION_REG + 2 - STATUS_REG
+AXIS0_POSITION_OFFSET: Final[int] = AXIS0_POSITION_REG - STATUS_REG
+AXIS1_POSITION_OFFSET: Final[int] = AXIS1_POSITION_REG - STATUS_REG
+
+# Error bits of both axes in the status word
+AXIS0_ERROR: Final[int] = 0x20
+AXIS1_ERROR: Final[int] = 0x2000
+AXIS_ERROR_MASK: Final[int] = AXIS0_ERROR | AXIS1_ERROR
+# Mask of the published status bits within one axis byte
+AXIS_STATUS_MASK: Final[int] = 0x7F
+
+POSITION_KEYS: Final = ("axis_0", "axis_1")
+
+# Status bits of one axis byte: axis 0 uses the lower byte of the status word, axis 1 the upper byte,
+# with the same layout. Listed in the order the keys are published.
+AXIS_STATUS_BITS = (
+    ("limit_neg", 0x01),
+    ("limit_pos", 0x02),
+    ("is_moving", 0x04),
+    ("is_done", 0x08),
+    ("is_homed", 0x10),
+    ("has_error", 0x20),
+    ("is_servo_mode", 0x40)
+)
+
+# Command subscriptions of one stepper, formatted with its slave ID: every axis command, and device-level
+# commands (one level below the stepper). Each is subscribed for both stepper/stepper{id} and stepper/{id}.
+AXIS_COMMAND_TOPIC = "stepper/{stepper}/axis/+/#"
+DEVICE_COMMAND_TOPIC = "stepper/{stepper}/+"
+# Command topic layout: stepper/[stepper]{stepper_id}[/axis/{axis_id}]/{command}
+COMMAND_TOPIC_RE = re.compile(r"stepper/(?:stepper)?(\d+)(?:/axis/(\d+))?/(.+)$")
+# Topics published by the controller itself, which the axis command wildcard also delivers back to it
+TELEMETRY_SUFFIXES = ("/state", "/state_bin", "/ack", "/ackz")
+
+# Both axis positions as read from the device: four 16-bit registers, low word first for each axis,
+# reinterpreted as two signed 32-bit integers
+POSITION_REGISTERS = struct.Struct("<4H")
+POSITION_WORDS = struct.Struct("<2i")
+
+# Kinds of operation on the bus queue, each queued as (kind, future, payload)
+BUS_CALL: Final[int] = 0            # payload: (function, args), run as-is on the bus worker
+BUS_CONTROL_WRITE: Final[int] = 1   # payload: (address, value), coalesced with control writes queued behind it
+BUS_STOP: Final[int] = 2            # stops the bus worker
+BUS_LATEST_CALL: Final[int] = 3     # payload: (key, entry) from _bus_call_latest; runs the newest call in entry
+
+# Binary state payload on stepper/stepper{id}/state_bin: status word, axis 0 position, axis 1 position
+STATE_BIN = struct.Struct("<Hii")
+
+# Combined per-axis state payload: a pre-serialized status object and the axis position
+AXIS_STATE_TEMPLATE = b'{"status":%s,"position":%d}'
+
+# Pre-serialized status payload for every combination of the seven axis status bits, indexed by the bits
+AXIS_STATUS_TABLE = tuple(
+    _dumps({key: bool(bits & mask) for key, mask in AXIS_STATUS_BITS})
+    for bits in range(AXIS_STATUS_MASK + 1)
+)
+
+# Ack delivery classes: high-rate acks that the next command supersedes go out fire-and-forget, while acks of
+# one-off commands that change the axis state are delivered at least once
+ACK_QOS_STREAM: Final = 0
+ACK_QOS_STATE: Final = 1
+
+# Acks longer than this many bytes are zlib-compressed and published on "<ack topic>z" (e.g. .../ackz) instead.
+# The payload is ACKZ_VERSION followed by the zlib stream; shorter acks would only grow by the zlib header.
+ACK_COMPRESS_THRESHOLD: Final = 256
+ACKZ_VERSION: Final = b"\x01"
+
+# Pre-serialized acks for commands whose ack carries no parameters: (failure, success), indexed by the result
+SIMPLE_ACKS = {
+    command: tuple(_dumps({"command": command, "success": success}) for success in (False, True))
+    for command in ("home", "stop", "enable", "disable", "reset", "disable_servo_mode")
+}
+
+def _run_bus_operation(futures, function, *args):
+    """Run one bus operation and resolve every future waiting on it with its result (or exception)"""
+    try:
+        result = function(*args)
+    except Exception as e:
+        for future in futures:
+            future.set_exception(e)
+    else:
+        for future in futures:
+            future.set_result(result)
+
+class AckBatcher:
+    """
+    Publishes command acks from a background thread, in batches, so command handlers never call into the
+    MQTT client themselves.
+    
+    Once an ack arrives the thread keeps collecting for up to max_delay seconds (or until max_batch acks are
+    waiting) and then publishes the whole batch back-to-back. Acks longer than ACK_COMPRESS_THRESHOLD bytes are
+    compressed there too, off the command path.
+    """
+    
+    def __init__(self, mqtt_service, max_batch=64, max_delay=0.005):
+        self.mqtt = mqtt_service
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+    
+    def start(self):
+        """Start the publishing thread"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Publish the acks still queued and stop the publishing thread"""
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join(timeout=1.0)
+            self._thread = None
+    
+    def enqueue(self, topic, payload, qos=ACK_QOS_STREAM):
+        """Queue an ack for publishing with the given MQTT QoS; never blocks"""
+        self._queue.put((topic, payload, qos))
+    
+    @staticmethod
+    def _compress(topic, payload):
+        """Return the (topic, payload) to publish for a long ack: compressed on the ackz topic if that is smaller"""
+        compressed = ACKZ_VERSION + zlib.compress(payload, 1)
+        if len(compressed) >= len(payload):
+            return topic, payload
+        return topic + "z", compressed
+    
+    def _run(self):
+        get = self._queue.get
+        publish = self.mqtt.publish
+        monotonic = time.monotonic
+        while True:
+            batch = [get()]
+            deadline = monotonic() + self.max_delay
+            while batch[-1] is not None and len(batch) < self.max_batch:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(get(timeout=timeout))
+                except queue.Empty:
+                    break
+            
+            stopping = False
+            for item in batch:
+                if item is None:
+                    # Stop sentinel; anything queued alongside it is still published
+                    stopping = True
+                else:
+                    topic, payload, qos = item
+                    if len(payload) > ACK_COMPRESS_THRESHOLD:
+                        topic, payload = self._compress(topic, payload)
+                    publish(topic, payload, qos)
+            if stopping:
+                return
+
+class Axis:
+    """One axis of a StepperMQTTController: turns axis commands into Modbus writes and publishes the acks"""
+    
+    __slots__ = ("parent", "axis_id", "_ack_topic", "_dispatch")
+    
+    # Pre-laid-out move_absolute ack; only the success flag and the numeric fields are filled in per command
+    _ACK_MOVE_ABS = (b'{"command":"move_absolute","success":%s,'
+                     b'"params":{"target":%d,"speed":%d,"accel":%d,"decel":%d}}')
+    # set_servo_speed runs at the control-loop rate, so its ack is laid out once as well
+    _ACK_SET_SPEED = b'{"command":"set_servo_speed","success":%s,"params":{"speed":%d}}'
+    
+    def __init__(self, parent, axis_id: int):
+        self.parent = parent
+        self.axis_id = axis_id
+        self._ack_topic = f"stepper/stepper{parent.slave_id}/axis/{axis_id}/ack"
+        # Bound handlers keyed by the command name parsed from the topic, so dispatching a command is one dict
+        # lookup followed by handler(payload)
+        self._dispatch = {
+            "move_absolute": self._move_absolute,
+            "move_relative": self._move_relative,
+            "home": self._home_axis,
+            "stop": self._stop_axis,
+            "enable": self._enable_axis,
+            "disable": self._disable_axis,
+            "reset": self._reset_axis,
+            "enable_servo": self._enable_servo_mode,
+            "disable_servo": self._disable_servo_mode,
+            "servo_speed": self._set_servo_speed,
+            "enable_and_run": self._enable_and_run
+        }
+    
+    def _ack_when_done(self, future, make_ack, qos=ACK_QOS_STATE):
+        """
+        Publish the ack make_ack(result) for this axis once the bus operation behind future has completed.
+        Acks default to ACK_QOS_STATE; high-rate commands pass ACK_QOS_STREAM.
+        
+        Returns:
+            The future, so callers can wait on the result if they need it
+        """
+        parent = self.parent
+        ack_topic = self._ack_topic
+        
+        def publish_ack(done):
+            if done.cancelled():
+                # Superseded by a newer command before it reached the bus; that command is acked instead
+                return
+            try:
+                result = done.result()
+            except Exception as e:
+                logger.error("Modbus operation failed on axis %d: %s", self.axis_id, e)
+                result = False
+            if parent.debug_modbus:
+                logger.debug("Modbus write result: %s", result)
+            parent.ack_batcher.enqueue(ack_topic, make_ack(result), qos)
+        
+        future.add_done_callback(publish_ack)
+        return future
+    
+    def _move_absolute(self, params):
+        """Move axis to absolute position"""
+        # The ack template formats these with %d, so they are converted (and bad values rejected) up front
+        parse_int = self._parse_int
+        target = parse_int(params.get('position', 0), "position")
+        speed = parse_int(params.get('speed', 1000), "speed")
+        accel = parse_int(params.get('acceleration', 1000), "acceleration")
+        decel = parse_int(params.get('deceleration', 1000), "deceleration")
+        if None in (target, speed, accel, decel):
+            return False
+        target_low = target & 0xFFFF
+        target_high = (target >> 16) & 0xFFFF
+        
+        logger.debug("Moving axis %d to absolute position %s at speed %s", self.axis_id, target, speed)
+        
+        # Register 0: Command register (2 = absolute move)
+        # Register 1: Target position
+        # Register 2: Speed
+        # Register 3: Acceleration
+        future = self.parent._bus_call(
+            self.parent.modbus.write_registers,
+            0,  # Starting address
+            [0x0102, self.axis_id, target_low, target_high, 0, 0, speed, accel, decel],  # Values
+            self.parent.slave_id
+        )
+        
+        # Publish acknowledgment once the bus operation has completed
+        return self._ack_when_done(
+            future,
+            lambda result: self._ACK_MOVE_ABS % (b"true" if result else b"false", target, speed, accel, decel)
+        )
+    
+    def _move_relative(self, params):
+        """Move axis by relative distance"""
+        parse_int = self._parse_int
+        distance = parse_int(params.get('distance', 0), "distance")
+        speed = parse_int(params.get('speed', 1000), "speed")
+        accel = parse_int(params.get('acceleration', 1000), "acceleration")
+        decel = parse_int(params.get('deceleration', 1000), "deceleration")
+        if None in (distance, speed, accel, decel):
+            return False
+        # Signed 32-bit distance, low word first (same layout as the absolute target)
+        distance_low = distance & 0xFFFF
+        distance_high = (distance >> 16) & 0xFFFF
+        
+        logger.debug("Moving axis %d by relative distance %s at speed %s", self.axis_id, distance, speed)
+        
+        # Register 0: Command register (3 = relative move)
+        # Register 1: Distance
+        # Register 2: Speed
+        # Register 3: Acceleration
+        future = self.parent._bus_call(
+            self.parent.modbus.write_registers,
+            0,  # Starting address
+            [0x0103, self.axis_id, distance_low, distance_high, 0, 0, speed, accel, decel],  # Values
+            self.parent.slave_id
+        )
+        
+        # Publish acknowledgment once the bus operation has completed
+        return self._ack_when_done(future, lambda result: _dumps({
+            "command": "move_relative",
+            "success": result,
+            "params": {
+                "distance": distance,
+                "speed": speed,
+                "accel": accel,
+                "decel": decel
+            }
+        }))
+    
+    def _home_axis(self,  params):
+        """Home the specified axis"""
+        direction = params.get('direction', 1)
+        speed = params.get('speed', 500)
+        
+        logger.debug("Homing axis %d in direction %s at speed %s", self.axis_id, direction, speed)
+        
+        # Register 0: Command register (1 = home)
+        # speed and direction are saved on the device
+        future = self.parent._bus_call(
+            self.parent.modbus.write_register,
+            0,  # Starting address
+            1,  # Value
+            self.parent.slave_id
+        )
+        
+        # Publish acknowledgment once the bus operation has completed
+        return self._ack_when_done(future, lambda result: SIMPLE_ACKS["home"][bool(result)])
+    
+    def _stop_axis(self, params=None):
+        """Stop the specified axis"""
+        logger.debug("Stopping axis %d", self.axis_id)
+        
+        # Register 0: Command register (0 = stop)
+        future = self.parent._bus_call(
+            self.parent.modbus.write_register,
+            0,  # Address
+            0,  # Value (stop command)
+            self.parent.slave_id
+        )
+        
+        # Publish acknowledgment once the bus operation has completed
+        return self._ack_when_done(future, lambda result: SIMPLE_ACKS["stop"][bool(result)])
+    
+    def _enable_axis(self, params=None):
+        """Enable the specified axis; the write may be coalesced with other control writes queued for the bus"""
+        logger.debug("Enabling axis %d", self.axis_id)
+        
+        # Register 4: Control register (bit 0 = enable)
+        return self.parent._control_write(4, 1, "enable", (self._ack_topic,))
+    
+    def _disable_axis(self, params=None):
+        """Disable the specified axis; the write may be coalesced with other control writes queued for the bus"""
+        logger.debug("Disabling axis %d", self.axis_id)
+        
+        # Register 4: Control register (bit 0 = enable)
+        return self.parent._control_write(4, 0, "disable", (self._ack_topic,))
+    
+    def _reset_axis(self, params=None):
+        """Reset the specified axis; the write may be coalesced with other control writes queued for the bus"""
+        logger.debug("Resetting axis %d", self.axis_id)
+        
+        # Register 5: Reset register
+        return self.parent._control_write(5, 1, "reset", (self._ack_topic,))
+
+    def _enable_servo_mode(self, params=None):
+        """Enable servo mode for this axis"""
+        logger.debug("Enabling servo mode for axis %d", self.axis_id)
+        
+        # Default parameters
+        if params is None:
+            params = {}
+            
+        # Extract parameters
+        max_speed = params.get('max_speed', 5000)
+        accel = params.get('acceleration', 1000)
+        
+        # Register 0: Command register (0x0201 = enable servo mode)
+        # Register 1: Axis ID
+        # Register 2: Max speed
+        # Register 3: Acceleration
+        future = self.parent._bus_call(
+            self.parent.modbus.write_registers,
+            0,  # Starting address
+            [0x0201, self.axis_id, max_speed, accel],  # Values
+            self.parent.slave_id
+        )
+        
+        # Publish acknowledgment once the bus operation has completed
+        return self._ack_when_done(future, lambda result: _dumps({
+            "command": "enable_servo_mode",
+            "success": result,
+            "params": {
+                "max_speed": max_speed,
+                "acceleration": accel
+            }
+        }))
+            
+    def _disable_servo_mode(self, params=None):
+        """Disable servo mode for this axis"""
+        logger.debug("Disabling servo mode for axis %d", self.axis_id)
+        
+        # Register 0: Command register (0x0202 = disable servo mode)
+        # Register 1: Axis ID
+        future = self.parent._bus_call(
+            self.parent.modbus.write_registers,
+            0,  # Starting address
+            [0x0202, self.axis_id],  # Values
+            self.parent.slave_id
+        )
+        
+        # Publish acknowledgment once the bus operation has completed
+        return self._ack_when_done(future, lambda result: SIMPLE_ACKS["disable_servo_mode"][bool(result)])
+            
+    @staticmethod
+    def _parse_int(value, name):
+        """Convert a numeric parameter to an integer; returns None (logging an error) if it isn't numeric"""
+        # One int() call covers ints, floats and integer strings; only strings like "12.5" need the float fallback
+        try:
+            return int(value)
+        except (TypeError, ValueError, OverflowError):
+            pass
+        if isinstance(value, str):
+            try:
+                return int(float(value))
+            except (ValueError, OverflowError):
+                pass
+        logger.error("Invalid %s value: %s", name, value)
+        return None
+    
+    @staticmethod
+    def _parse_speed(speed):
+        """Convert a speed parameter to a signed integer; returns None (logging an error) if it isn't numeric"""
+        return Axis._parse_int(speed, "speed")
+    
+    def _set_servo_speed(self, params):
+        """Set speed in servo mode for this axis"""
+        if not params:
+            logger.error("No parameters provided for set_servo_speed command on axis %d", self.axis_id)
+            return False
+        
+        # Extract speed parameter
+        speed = self._parse_speed(params.get('speed', 0))
+        if speed is None:
+            return False
+        
+        logger.debug("Setting servo speed for axis %d to %s", self.axis_id, speed)
+        
+        # Register 0: Command register (0x0203 = set servo speed)
+        # Register 1: Axis ID
+        # Register 2: Speed (signed integer)
+        # Only the newest speed matters: one still waiting for the bus is replaced rather than sent first
+        future = self.parent._bus_call_latest(
+            (self.axis_id, "servo_speed"),
+            self.parent.modbus.write_registers,
+            0,  # Starting address
+            [0x0203, self.axis_id, speed],  # Values
+            self.parent.slave_id
+        )
+        
+        # Publish acknowledgment once the bus operation has completed (superseded speeds are not acked)
+        return self._ack_when_done(
+            future,
+            lambda result: self._ACK_SET_SPEED % (b"true" if result else b"false", speed),
+            ACK_QOS_STREAM
+        )
+    
+    def enable_and_set_speed(self, max_speed, accel, speed):
+        """
+        Enable servo mode and set the servo speed as a single bus operation: both command writes run
+        back-to-back on the bus worker, with nothing else on the bus in between.
+        
+        The two commands are not merged into one write spanning both: the second block would start at
+        register 4, overwriting the control and reset registers.
+        
+        Returns:
+            Future resolved with True if both writes succeeded
+        """
+        modbus = self.parent.modbus
+        slave_id = self.parent.slave_id
+        axis_id = self.axis_id
+        
+        def enable_and_run():
+            # Register 0: Command register (0x0201 = enable servo mode, then 0x0203 = set servo speed)
+            # Register 1: Axis ID
+            # Register 2: Max speed, then speed (signed integer)
+            # Register 3: Acceleration
+            return (modbus.write_registers(0, [0x0201, axis_id, max_speed, accel], slave_id)
+                    and modbus.write_registers(0, [0x0203, axis_id, speed], slave_id))
+        
+        return self.parent._bus_call(enable_and_run)
+    
+    def _enable_and_run(self, params=None):
+        """Enable servo mode and start moving at the given speed"""
+        # Default parameters
+        if params is None:
+            params = {}
+            
+        max_speed = params.get('max_speed', 5000)
+        accel = params.get('acceleration', 1000)
+        speed = self._parse_speed(params.get('speed', 0))
+        if speed is None:
+            return False
+        
+        logger.debug("Enabling servo mode for axis %d at speed %s", self.axis_id, speed)
+        
+        future = self.enable_and_set_speed(max_speed, accel, speed)
+        
+        # Publish acknowledgment once the bus operation has completed
+        return self._ack_when_done(future, lambda result: _dumps({
+            "command": "enable_and_run",
+            "success": result,
+            "params": {
+                "max_speed": max_speed,
+                "acceleration": accel,
+                "speed": speed
+            }
+        }))
+
 class StepperMQTTController:
     """
     Combined controller that handles both MQTT communication and stepper control via Modbus.
@@ -22,12 +544,35 @@ class StepperMQTTController:
     1. Connects to MQTT broker
     2. Subscribes to stepper command topics
     3. Translates MQTT commands to Modbus commands
-    4. Polls stepper status and position
-    5. Publishes status and position updates to MQTT
+    4. Publishes command acks through an AckBatcher
+    5. Polls stepper status and position
+    6. Publishes status and position updates to MQTT (one retained state topic per axis, plus a packed
+       binary state topic for the whole device)
     """
     
+    # Commands on stepper/{stepper_id}/{command} that apply to every axis, as the (register, value) they write.
+    # The enable and reset registers are shared by both axes, so one write covers the whole device.
+    DEVICE_COMMANDS = {
+        "enable": (4, 1),   # Register 4: Control register (bit 0 = enable)
+        "disable": (4, 0),
+        "reset": (5, 1)     # Register 5: Reset register
+    }
+    
+    # Status payload published for both axes when the status read fails
+    _DEFAULT_AXIS_STATUS_JSON = _dumps({
+        "limit_neg": False,
+        "limit_pos": False,
+        "is_moving": False,
+        "is_done": False,
+        "is_homed": False,
+        "has_error": False,
+        "is_servo_mode": False,
+        "is_stalled": False,
+        "is_enabled": False
+    })
+    
     def __init__(self, mqtt_service: MQTTService, 
-                 modbus_connection: ModbusConnection, slave_id=1, poll_interval=0.1):
+                 modbus_connection: ModbusConnection, slave_id=1, poll_interval=0.1, publish_json=True):
         """
         Initialize the StepperMQTTController.
         
@@ -36,6 +581,8 @@ class StepperMQTTController:
             modbus_connection: Modbus connection instance
             slave_id: Modbus slave ID (device address)
             poll_interval: Interval in seconds between status polls (default: 0.1)
+            publish_json: Also publish the per-axis JSON state topics next to the binary state_bin topic
+                (default: True)
         """
         # MQTT setup
         self.mqtt = mqtt_service
@@ -48,13 +595,29 @@ class StepperMQTTController:
         # Threading
         self.running = False
         self.poll_thread = None
-        self.lock = threading.Lock()
+        # Every Modbus transaction runs on one bus worker thread that owns the connection; other threads
+        # queue operations on bus_queue and get a Future back
+        self.bus_queue = queue.SimpleQueue()
+        self._bus_thread = None
+        # Newest not-yet-run _bus_call_latest entry by key: {key: [future, function, args, seq]}, where seq is the
+        # value of _bus_seq (a count of queued operations) when the entry was queued
+        self._latest_calls = {}
+        self._bus_seq = 0
+        self._latest_lock = threading.Lock()
+        # Commands are handed off paho's network thread to a worker, so Modbus latency never stalls keepalives
+        self._cmd_queue = queue.SimpleQueue()
+        self._cmd_thread = None
+        # Acks are published from their own thread, in batches
+        self.ack_batcher = AckBatcher(mqtt_service)
 
         # Create axis instances
-        self.axis0 = self.Axis(self, 0)
-        self.axis1 = self.Axis(self, 1)
+        self.axis0 = Axis(self, 0)
+        self.axis1 = Axis(self, 1)
+        # Axes indexed by the axis ID used in command topics
+        self.axes = (self.axis0, self.axis1)
         
-        # State tracking
+        # State tracking. Both dicts are replaced wholesale rather than mutated, so readers always see a
+        # consistent snapshot without taking a lock.
         self.positions = {"axis_0": 0, "axis_1": 0}
         self.status = {
             "slave_id": slave_id,
@@ -62,15 +625,30 @@ class StepperMQTTController:
             "error": None
         }
         
-        # Register command handlers
+        # MQTT topics for each axis, built once instead of on every publish
+        topic_base = f"stepper/stepper{slave_id}/axis"
+        self._topic_axis_state = (f"{topic_base}/0/state", f"{topic_base}/1/state")
+        self._topic_state_bin = f"stepper/stepper{slave_id}/state_bin"
+        self.publish_json = publish_json
+        
+        # Last published payloads; unchanged values are not published again
+        self._last_state_payload = [None, None]
+        self._last_state_bin = None
+        
+        # Command handlers by name, for calling commands programmatically as handler(axis_id, payload).
+        # MQTT commands skip these delegators and go straight to the axis dispatch tables (Axis._dispatch).
         self.command_handlers = {
-            "move/absolute": self._move_absolute,
-            "move/relative": self._move_relative,
+            "move_absolute": self._move_absolute,
+            "move_relative": self._move_relative,
             "home": self._home_axis,
             "stop": self._stop_axis,
             "enable": self._enable_axis,
             "disable": self._disable_axis,
-            "reset": self._reset_axis
+            "reset": self._reset_axis,
+            "enable_servo": self._enable_servo_mode,
+            "disable_servo": self._disable_servo_mode,
+            "servo_speed": self._set_servo_speed,
+            "enable_and_run": self._enable_and_run
         }
         
         # Debug flags
@@ -87,7 +665,7 @@ class StepperMQTTController:
         # Connect to services
         self.mqtt.start()
         connected = self.modbus.connect()
-        self.status["connected"] = connected
+        self.status = dict(self.status, connected=connected)
         
         if not connected:
             logger.error(f"Failed to connect to Modbus device on port {self.modbus.port}")
@@ -95,11 +673,18 @@ class StepperMQTTController:
         
         logger.info(f"Connected to Modbus device on port {self.modbus.port}")
         
+        # Start the bus worker, the ack publisher and the command worker before any command can arrive
+        self._bus_thread = threading.Thread(target=self._bus_worker, daemon=True)
+        self._bus_thread.start()
+        self.ack_batcher.start()
+        self.running = True
+        self._cmd_thread = threading.Thread(target=self._command_worker, daemon=True)
+        self._cmd_thread.start()
+        
         # Subscribe to command topics
         self._subscribe_to_commands()
         
         # Start status polling
-        self.running = True
         self.poll_thread = threading.Thread(target=self._poll_status)
         self.poll_thread.daemon = True
         self.poll_thread.start()
@@ -111,9 +696,18 @@ class StepperMQTTController:
         """Stop the controller and clean up resources"""
         logger.info("Stopping StepperMQTTController")
         self.running = False
+        if self._cmd_thread:
+            # Wake the worker with the stop sentinel
+            self._cmd_queue.put(None)
+            self._cmd_thread.join(timeout=1.0)
         if self.poll_thread:
             self.poll_thread.join(timeout=1.0)
+        if self._bus_thread:
+            # Operations already queued are still sent; the stop marker is handled after them
+            self.bus_queue.put((BUS_STOP, None, None))
+            self._bus_thread.join(timeout=1.0)
         self.modbus.disconnect()
+        self.ack_batcher.stop()
         self.mqtt.stop()
         logger.info("StepperMQTTController stopped")
     
@@ -126,258 +720,302 @@ class StepperMQTTController:
     
     def _subscribe_to_commands(self):
         """Subscribe to MQTT command topics"""
-        # Subscribe to move commands
-        self.mqtt.subscribe(f"stepper/+/axis/+/move/absolute", self._on_command)
-        self.mqtt.subscribe(f"stepper/+/axis/+/move/relative", self._on_command)
-        logger.info(f"Subscribing to topic: stepper/+/axis/+/move/absolute")
-        logger.info(f"Subscribing to topic: stepper/+/axis/+/move/relative")
-        
-        # Subscribe to other axis commands
-        self.mqtt.subscribe(f"stepper/+/axis/+/home", self._on_command)
-        self.mqtt.subscribe(f"stepper/+/axis/+/stop", self._on_command)
-        self.mqtt.subscribe(f"stepper/+/axis/+/enable", self._on_command)
-        self.mqtt.subscribe(f"stepper/+/axis/+/disable", self._on_command)
-        self.mqtt.subscribe(f"stepper/+/axis/+/reset", self._on_command)
-        logger.info(f"Subscribing to topic: stepper/+/axis/+/home")
-        logger.info(f"Subscribing to topic: stepper/+/axis/+/stop")
-        logger.info(f"Subscribing to topic: stepper/+/axis/+/enable")
-        logger.info(f"Subscribing to topic: stepper/+/axis/+/disable")
-        logger.info(f"Subscribing to topic: stepper/+/axis/+/reset")
-        
-        # Subscribe to servo mode commands
-        self.mqtt.subscribe(f"stepper/+/axis/+/enable_servo", self._on_command)
-        self.mqtt.subscribe(f"stepper/+/axis/+/disable_servo", self._on_command)
-        self.mqtt.subscribe(f"stepper/+/axis/+/servo_speed", self._on_command)
-        logger.info(f"Subscribing to topic: stepper/+/axis/+/enable_servo")
-        logger.info(f"Subscribing to topic: stepper/+/axis/+/disable_servo")
-        logger.info(f"Subscribing to topic: stepper/+/axis/+/servo_speed")
-        
-        # Subscribe to device-level commands
-        self.mqtt.subscribe(f"stepper/+/enable", self._on_command)
-        self.mqtt.subscribe(f"stepper/+/disable", self._on_command)
-        self.mqtt.subscribe(f"stepper/+/reset", self._on_command)
-        logger.info(f"Subscribing to topic: stepper/+/enable")
-        logger.info(f"Subscribing to topic: stepper/+/disable")
-        logger.info(f"Subscribing to topic: stepper/+/reset")
+        # Per stepper name, two wildcard filters cover every command. They do not overlap, because paho invokes
+        # the callback once per matching filter: axis commands (including move/absolute and move/relative),
+        # and single-level device commands. They only match this stepper, so the broker never forwards
+        # commands meant for other steppers on the same bus.
+        for stepper in (f"stepper{self.slave_id}", str(self.slave_id)):
+            for template in (AXIS_COMMAND_TOPIC, DEVICE_COMMAND_TOPIC):
+                topic = template.format(stepper=stepper)
+                self.mqtt.subscribe(topic, self._on_command)
+                logger.info(f"Subscribing to topic: {topic}")
     
     def _on_command(self, client, userdata, msg):
-        """Handle incoming MQTT command messages"""
+        """Queue incoming MQTT command messages for the command worker (runs on paho's network thread)"""
+        topic = msg.topic
+        
+        # The axis wildcard also matches the state/ack topics this controller publishes
+        if topic.endswith(TELEMETRY_SUFFIXES):
+            return
+        
+        self._cmd_queue.put((topic, msg.payload))
+    
+    def _command_worker(self):
+        """Execute queued commands in arrival order until the stop sentinel is received"""
+        while True:
+            item = self._cmd_queue.get()
+            if item is None:
+                break
+            self._dispatch_command(*item)
+    
+    def _dispatch_command(self, topic, payload_bytes):
+        """Parse a command topic and payload and run the matching handler"""
         try:
-            topic = msg.topic
-            payload_str = msg.payload.decode('utf-8')
-            
-            # Always log received commands
-            logger.info(f"Received MQTT command on topic {topic}: {payload_str}")
-            
-            # Log debug message if debug_mqtt is enabled
-            if self.debug_mqtt:
-                logger.debug(f"Processing MQTT command: {topic} - {payload_str}")
-            
             # Parse the topic to extract command information
             # Expected format: stepper/{stepper_id}/axis/{axis_id}/{command}
             # or: stepper/{stepper_id}/{command} for device-level commands
-            topic_parts = topic.split('/')
-            
-            if len(topic_parts) < 3:
-                logger.warning(f"Invalid topic format: {topic}")
+            match = COMMAND_TOPIC_RE.match(topic)
+            if match is None:
+                logger.warning("Invalid topic format: %s", topic)
                 return
+            stepper_id, axis_id, command = match.groups()
                 
-            # Extract stepper ID from topic
-            stepper_id_str = topic_parts[1].replace('stepper', '')
-            try:
-                stepper_id = int(stepper_id_str)
-            except ValueError:
-                stepper_id = 0  # Default to 0 if not a number
-                
-            # Check if this command is for us
-            if stepper_id != self.slave_id and stepper_id != '+':
+            # Check if this command is for us before touching the payload
+            stepper_id = int(stepper_id)
+            if stepper_id != self.slave_id:
                 if self.debug_mqtt:
-                    logger.debug(f"Ignoring command for different stepper: {stepper_id}")
+                    logger.debug("Ignoring command for different stepper: %s", stepper_id)
                 return
+            
+            # Always log received commands (formatted lazily, only if the record is emitted)
+            logger.info("Received MQTT command on topic %s: %s", topic, payload_bytes)
+            
+            # Log debug message if debug_mqtt is enabled
+            if self.debug_mqtt and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Processing MQTT command: %s - %s", topic, payload_bytes)
                 
             # Parse the payload as JSON
             try:
-                payload = json.loads(payload_str)
-            except json.JSONDecodeError:
-                logger.error(f"Invalid JSON in payload: {payload_str}")
+                payload = _loads(payload_bytes)
+            except ValueError:
+                logger.error("Invalid JSON in payload: %s", payload_bytes)
                 return
                 
             # Process device-level commands
-            if len(topic_parts) == 3:
-                command = topic_parts[2]
+            if axis_id is None:
                 if self.debug_mqtt:
-                    logger.debug(f"Processing device command: {command}")
+                    logger.debug("Processing device command: %s", command)
                     
-                if command == 'enable':
-                    self._enable_axis(0)
-                    self._enable_axis(1)
-                elif command == 'disable':
-                    self._disable_axis(0)
-                    self._disable_axis(1)
-                elif command == 'reset':
-                    self._reset_axis(0)
-                    self._reset_axis(1)
-                else:
-                    logger.warning(f"Unknown device command: {command}")
+                if command not in self.DEVICE_COMMANDS:
+                    logger.warning("Unknown device command: %s", command)
+                    return
+                self._device_command(command)
                 return
                 
             # Process axis-specific commands
-            if len(topic_parts) >= 5 and topic_parts[2] == 'axis':
-                try:
-                    axis_id = int(topic_parts[3])
-                except ValueError:
-                    logger.error(f"Invalid axis ID: {topic_parts[3]}")
-                    return
-                    
-                command = topic_parts[4]
-                
-                # For move commands, there's an additional part
-                if len(topic_parts) >= 6 and topic_parts[4] == 'move':
-                    command = f"move_{topic_parts[5]}"
-                
-                if self.debug_mqtt:
-                    logger.debug(f"Processing axis command: {command} for axis {axis_id}")
-                
-                # Execute the appropriate command
-                if command == 'move_absolute':
-                    self._move_absolute(axis_id, payload)
-                elif command == 'move_relative':
-                    self._move_relative(axis_id, payload)
-                elif command == 'home':
-                    self._home_axis(axis_id, payload)
-                elif command == 'stop':
-                    self._stop_axis(axis_id)
-                elif command == 'enable':
-                    self._enable_axis(axis_id)
-                elif command == 'disable':
-                    self._disable_axis(axis_id)
-                elif command == 'reset':
-                    self._reset_axis(axis_id)
-                elif command == 'enable_servo':
-                    self._enable_servo_mode(axis_id, payload)
-                elif command == 'disable_servo':
-                    self._disable_servo_mode(axis_id)
-                elif command == 'servo_speed':
-                    self._set_servo_speed(axis_id, payload)
-                else:
-                    logger.warning(f"Unknown axis command: {command}")
+            axis_id = int(axis_id)
+            
+            # Multi-level commands map onto handler names, e.g. move/absolute -> move_absolute
+            command = command.replace('/', '_')
+            
+            if self.debug_mqtt:
+                logger.debug("Processing axis command: %s for axis %d", command, axis_id)
+            
+            # Execute the appropriate command straight on the axis
+            axis = self._axis(axis_id, command)
+            if axis is None:
+                return
+            handler = axis._dispatch.get(command)
+            if handler is None:
+                logger.warning("Unknown axis command: %s", command)
+                return
+            handler(payload)
                     
         except Exception as e:
-            logger.exception(f"Error processing MQTT command: {e}")
+            logger.exception("Error processing MQTT command: %s", e)
     
     # ===== Command Delegation Methods =====
     
+    def _device_command(self, command):
+        """Apply a device-level command to both axes with a single register write, acknowledging it on each axis"""
+        address, value = self.DEVICE_COMMANDS[command]
+        return self._control_write(address, value, command, tuple(axis._ack_topic for axis in self.axes))
+    
+    # ===== Bus Worker =====
+    
+    def _bus_call(self, function, *args):
+        """Queue function(*args) to run on the bus worker; returns a Future resolved with its result"""
+        future = Future()
+        with self._latest_lock:
+            self._bus_seq += 1
+            self.bus_queue.put((BUS_CALL, future, (function, args)))
+        return future
+    
+    def _bus_call_latest(self, key, function, *args):
+        """
+        Queue function(*args) like _bus_call, but conflated by key: if the last operation queued is a call under
+        the same key that has not run yet, this call takes its place and the superseded call's future is
+        cancelled. Calls are never merged across another queued operation, so bus order is preserved.
+        
+        For commands where only the newest value matters (e.g. servo speed), so a burst of them costs one bus
+        transaction instead of one per command.
+        
+        Returns:
+            Future resolved with the result of the call, or cancelled if a newer call superseded it
+        """
+        future = Future()
+        superseded = None
+        with self._latest_lock:
+            entry = self._latest_calls.get(key)
+            if entry is not None and entry[3] == self._bus_seq:
+                superseded = entry[0]
+                entry[:3] = future, function, args
+            else:
+                self._bus_seq += 1
+                entry = [future, function, args, self._bus_seq]
+                self._latest_calls[key] = entry
+                self.bus_queue.put((BUS_LATEST_CALL, None, (key, entry)))
+        if superseded is not None:
+            superseded.cancel()
+        return future
+    
+    def _control_write(self, address, value, command, ack_topics):
+        """
+        Queue a control register write. The bus worker sends it together with the control writes queued
+        right behind it, as long as their addresses keep ascending. So writes still reach the device in the
+        order they were queued, and none is overwritten before it was sent.
+        
+        Args:
+            address: Register address
+            value: Register value
+            command: Command name, used to pick the ack payload
+            ack_topics: Topics to publish the ack on once the write has completed
+            
+        Returns:
+            Future resolved with the result of the write
+        """
+        future = Future()
+        
+        def publish_ack(done):
+            try:
+                result = done.result()
+            except Exception as e:
+                logger.error("Modbus control write failed: %s", e)
+                result = False
+            if self.debug_modbus:
+                logger.debug("Modbus write result: %s", result)
+            ack = SIMPLE_ACKS[command][bool(result)]
+            for topic in ack_topics:
+                self.ack_batcher.enqueue(topic, ack, ACK_QOS_STATE)
+        
+        future.add_done_callback(publish_ack)
+        with self._latest_lock:
+            self._bus_seq += 1
+            self.bus_queue.put((BUS_CONTROL_WRITE, future, (address, value)))
+        return future
+    
+    def _bus_worker(self):
+        """
+        Run queued bus operations in order until BUS_STOP, coalescing runs of queued control writes and running
+        only the newest of any conflated (_bus_call_latest) calls
+        """
+        get = self.bus_queue.get
+        get_nowait = self.bus_queue.get_nowait
+        held = None
+        while True:
+            if held is None:
+                kind, future, payload = get()
+            else:
+                (kind, future, payload), held = held, None
+            
+            if kind == BUS_STOP:
+                break
+            
+            if kind == BUS_CALL:
+                function, args = payload
+                _run_bus_operation((future,), function, *args)
+                continue
+            
+            if kind == BUS_LATEST_CALL:
+                # Run whatever is newest in this entry; once it is out of the table a later call queues a fresh one
+                key, entry = payload
+                with self._latest_lock:
+                    if self._latest_calls.get(key) is entry:
+                        del self._latest_calls[key]
+                    future, function, args = entry[:3]
+                if future.set_running_or_notify_cancel():
+                    _run_bus_operation((future,), function, *args)
+                continue
+            
+            # Take the control writes already queued behind this one, so they share as few requests as possible:
+            # one per run of contiguous registers
+            batch = self.modbus.batch(self.slave_id)
+            batch.write(*payload)
+            futures = [future]
+            last_address = payload[0]
+            while True:
+                try:
+                    item = get_nowait()
+                except queue.Empty:
+                    break
+                if item[0] != BUS_CONTROL_WRITE:
+                    # Keep queue order: run it right after this batch
+                    held = item
+                    break
+                address = item[2][0]
+                if address <= last_address:
+                    # The batch is sent in address order and keeps one value per register, so merging this write
+                    # would reorder it before, or overwrite, a staged one; send what is staged first
+                    _run_bus_operation(futures, batch.flush)
+                    batch = self.modbus.batch(self.slave_id)
+                    futures = []
+                futures.append(item[1])
+                batch.write(*item[2])
+                last_address = address
+            _run_bus_operation(futures, batch.flush)
+    
+    def _axis(self, axis_id, command):
+        """Return the axis with the given ID, or None (logging an error) if there is no such axis"""
+        try:
+            return self.axes[axis_id]
+        except (IndexError, TypeError):
+            logger.error("Invalid axis ID for %s: %s", command, axis_id)
+            return None
+    
     def _move_absolute(self, axis_id, params):
         """Delegate absolute move command to the appropriate axis"""
-        if axis_id == 0:
-            return self.axis0._move_absolute(params)
-        elif axis_id == 1:
-            return self.axis1._move_absolute(params)
-        else:
-            logger.error(f"Invalid axis ID for move_absolute: {axis_id}")
-            return False
+        axis = self._axis(axis_id, "move_absolute")
+        return axis._move_absolute(params) if axis else False
     
     def _move_relative(self, axis_id, params):
         """Delegate relative move command to the appropriate axis"""
-        if axis_id == 0:
-            return self.axis0._move_relative(params)
-        elif axis_id == 1:
-            return self.axis1._move_relative(params)
-        else:
-            logger.error(f"Invalid axis ID for move_relative: {axis_id}")
-            return False
+        axis = self._axis(axis_id, "move_relative")
+        return axis._move_relative(params) if axis else False
     
     def _home_axis(self, axis_id, params):
         """Delegate home command to the appropriate axis"""
-        if axis_id == 0:
-            return self.axis0._home_axis(params)
-        elif axis_id == 1:
-            return self.axis1._home_axis(params)
-        else:
-            logger.error(f"Invalid axis ID for home: {axis_id}")
-            return False
+        axis = self._axis(axis_id, "home")
+        return axis._home_axis(params) if axis else False
     
     def _stop_axis(self, axis_id, params=None):
         """Delegate stop command to the appropriate axis"""
-        if axis_id == 0:
-            return self.axis0._stop_axis()
-        elif axis_id == 1:
-            return self.axis1._stop_axis()
-        else:
-            logger.error(f"Invalid axis ID for stop: {axis_id}")
-            return False
+        axis = self._axis(axis_id, "stop")
+        return axis._stop_axis(params) if axis else False
     
     def _enable_axis(self, axis_id, params=None):
         """Delegate enable command to the appropriate axis"""
-        if axis_id == 0:
-            return self.axis0._enable_axis()
-        elif axis_id == 1:
-            return self.axis1._enable_axis()
-        else:
-            logger.error(f"Invalid axis ID for enable: {axis_id}")
-            return False
+        axis = self._axis(axis_id, "enable")
+        return axis._enable_axis(params) if axis else False
     
     def _disable_axis(self, axis_id, params=None):
         """Delegate disable command to the appropriate axis"""
-        if axis_id == 0:
-            return self.axis0._disable_axis()
-        elif axis_id == 1:
-            return self.axis1._disable_axis()
-        else:
-            logger.error(f"Invalid axis ID for disable: {axis_id}")
-            return False
+        axis = self._axis(axis_id, "disable")
+        return axis._disable_axis(params) if axis else False
     
     def _reset_axis(self, axis_id, params=None):
         """Delegate reset command to the appropriate axis"""
-        if axis_id == 0:
-            return self.axis0._reset_axis()
-        elif axis_id == 1:
-            return self.axis1._reset_axis()
-        else:
-            logger.error(f"Invalid axis ID for reset: {axis_id}")
-            return False
+        axis = self._axis(axis_id, "reset")
+        return axis._reset_axis(params) if axis else False
 
     def _enable_servo_mode(self, axis_id, params=None):
         """Enable servo mode for the specified axis"""
-        logger.info(f"Enabling servo mode for axis {axis_id}")
-        
-        # Default parameters
-        if params is None:
-            params = {}
-            
-        # Get the axis instance
-        axis = self.axis0 if axis_id == 0 else self.axis1
-        
-        # Call the axis method
-        return axis._enable_servo_mode(params)
+        axis = self._axis(axis_id, "enable_servo")
+        return axis._enable_servo_mode(params) if axis else False
         
     def _disable_servo_mode(self, axis_id, params=None):
         """Disable servo mode for the specified axis"""
-        logger.info(f"Disabling servo mode for axis {axis_id}")
-        
-        # Default parameters
-        if params is None:
-            params = {}
-            
-        # Get the axis instance
-        axis = self.axis0 if axis_id == 0 else self.axis1
-        
-        # Call the axis method
-        return axis._disable_servo_mode(params)
+        axis = self._axis(axis_id, "disable_servo")
+        return axis._disable_servo_mode(params) if axis else False
         
     def _set_servo_speed(self, axis_id, params):
         """Set speed in servo mode for the specified axis"""
-        if not params:
-            logger.error(f"No parameters provided for set_servo_speed command on axis {axis_id}")
-            return False
-            
-        logger.info(f"Setting servo speed for axis {axis_id}: {params}")
-        
-        # Get the axis instance
-        axis = self.axis0 if axis_id == 0 else self.axis1
-        
-        # Call the axis method
-        return axis._set_servo_speed(params)
+        axis = self._axis(axis_id, "servo_speed")
+        return axis._set_servo_speed(params) if axis else False
+    
+    def _enable_and_run(self, axis_id, params=None):
+        """Enable servo mode and set the servo speed for the specified axis in one bus operation"""
+        axis = self._axis(axis_id, "enable_and_run")
+        return axis._enable_and_run(params) if axis else False
 
     # ===== Status Polling =====
     
@@ -386,505 +1024,101 @@ class StepperMQTTController:
         logger.info("Starting status polling thread")
         poll_count = 0
         
-        # Define register addresses
-        STATUS_REG = 0x0D           # Status register for both axes
-        AXIS0_POSITION_REG = 0x11   # Axis 0 position registers (2 words)
-        AXIS1_POSITION_REG = 0x13   # Axis 1 position registers (2 words)
-        
-        # Status bit masks for axis 0 (lower byte)
-        AXIS0_LIMIT_NEG = 0x01
-        AXIS0_LIMIT_POS = 0x02
-        AXIS0_BUSY = 0x04
-        AXIS0_DONE = 0x08
-        AXIS0_HOMED = 0x10
-        AXIS0_ERROR = 0x20
-        
-        # Status bit masks for axis 1 (upper byte)
-        AXIS1_LIMIT_NEG = 0x0100
-        AXIS1_LIMIT_POS = 0x0200
-        AXIS1_BUSY = 0x0400
-        AXIS1_DONE = 0x0800
-        AXIS1_HOMED = 0x1000
-        AXIS1_ERROR = 0x2000
+        # Bind everything the loop touches on every poll to locals once
+        publish = self.mqtt.publish
+        read_registers = self.modbus.read_registers
+        bus_call = self._bus_call
+        slave_id = self.slave_id
+        topic_axis_state = self._topic_axis_state
+        topic_state_bin = self._topic_state_bin
+        last_state_payload = self._last_state_payload
+        unpack_positions = POSITION_WORDS.unpack
+        pack_position_registers = POSITION_REGISTERS.pack
+        pack_state_bin = STATE_BIN.pack
+        monotonic = time.monotonic
+        
+        # Polls are scheduled against fixed deadlines, so the time spent polling does not stretch the interval
+        next_deadline = monotonic()
         
         while self.running:
             try:
                 poll_count += 1
-                with self.lock:
-                    # Read the status register
-                    status_values = self.modbus.read_registers(
-                        1, STATUS_REG, self.slave_id
-                    )
-                    
-                    if status_values and len(status_values) > 0:
-                        status_word = status_values[0]
-                        
-                        # Extract axis 0 status (lower byte)
-                        axis0_status_dict = {
-                            "limit_neg": bool(status_word & AXIS0_LIMIT_NEG),
-                            "limit_pos": bool(status_word & AXIS0_LIMIT_POS),
-                            "is_moving": bool(status_word & AXIS0_BUSY),
-                            "is_done": bool(status_word & AXIS0_DONE),
-                            "is_homed": bool(status_word & AXIS0_HOMED),
-                            "has_error": bool(status_word & AXIS0_ERROR),
-                            "is_servo_mode": bool(status_word & 0x40)  # Bit 6 for servo mode
-                        }
-                        
-                        # Extract axis 1 status (upper byte)
-                        axis1_status_dict = {
-                            "limit_neg": bool(status_word & AXIS1_LIMIT_NEG),
-                            "limit_pos": bool(status_word & AXIS1_LIMIT_POS),
-                            "is_moving": bool(status_word & AXIS1_BUSY),
-                            "is_done": bool(status_word & AXIS1_DONE),
-                            "is_homed": bool(status_word & AXIS1_HOMED),
-                            "has_error": bool(status_word & AXIS1_ERROR),
-                            "is_servo_mode": bool(status_word & 0x4000)  # Bit 14 for servo mode
-                        }
-                        
-                        # Update connection status
-                        self.status["connected"] = True
-                        self.status["error"] = "Error detected" if (axis0_status_dict["has_error"] or axis1_status_dict["has_error"]) else None
-                        
-                        if self.debug_modbus and poll_count % 10 == 0:  # Log every 10th poll to avoid spam
-                            logger.debug(f"Status Word: 0x{status_word:04X}, " +
-                                        f"Axis0: {axis0_status_dict}, " +
-                                        f"Axis1: {axis1_status_dict}")
-                    else:
-                        # Default values if read fails
-                        axis0_status_dict = {
-                            "limit_neg": False,
-                            "limit_pos": False,
-                            "is_moving": False,
-                            "is_done": False,
-                            "is_homed": False,
-                            "has_error": False,
-                            "is_servo_mode": False,
-                            "is_stalled": False,
-                            "is_enabled": False
-                        }
-                        
-                        axis1_status_dict = {
-                            "limit_neg": False,
-                            "limit_pos": False,
-                            "is_moving": False,
-                            "is_done": False,
-                            "is_homed": False,
-                            "has_error": False,
-                            "is_servo_mode": False,
-                            "is_stalled": False,
-                            "is_enabled": False
-                        }
+                # Read the status word and both axis positions (0x0D..0x14) in a single transaction on the bus
+                # worker; decoding and publishing happen back on this thread
+                regs = bus_call(read_registers, STATUS_REG, STATE_REG_COUNT, slave_id).result()
+                
+                if regs and len(regs) == STATE_REG_COUNT:
+                    status_word = regs[0]
                     
-                    # Read position registers for each axis
-                    # Try to read both positions in one operation if they're consecutive
-                    if AXIS0_POSITION_REG + 2 == AXIS1_POSITION_REG:  # Check if registers are consecutive
-                        position_regs = self.modbus.read_registers(
-                            AXIS0_POSITION_REG, 4, self.slave_id  # Read both axis positions (2 words each)
-                        )
-                        
-                        if position_regs and len(position_regs) == 4:
-                            # Combine low and high registers for axis 0
-                            position0 = (position_regs[1] << 16) | position_regs[0]
-                            self.positions["axis_0"] = position0
-                            
-                            # Combine low and high registers for axis 1
-                            position1 = (position_regs[3] << 16) | position_regs[2]
-                            self.positions["axis_1"] = position1
-                            
-                            if self.debug_modbus and poll_count % 10 == 0:
-                                logger.debug(f"Position axis_0: {position0}, axis_1: {position1}")
-                    else:
-                        # Fallback to individual reads if registers aren't consecutive
-                        for axis in range(2):  # Assuming 2 axes
-                            position_reg = AXIS0_POSITION_REG if axis == 0 else AXIS1_POSITION_REG
-                            position_regs = self.modbus.read_registers(
-                                2, position_reg, self.slave_id
-                            )
-                            
-                            if position_regs and len(position_regs) >= 2:
-                                # Combine low and high registers
-                                position = (position_regs[1] << 16) | position_regs[0]
-                                self.positions[f"axis_{axis}"] = position
-                                
-                                if self.debug_modbus and poll_count % 10 == 0:
-                                    logger.debug(f"Position axis_{axis}: {position}")
+                    # Look up the ready-made payloads for axis 0 (lower byte) and axis 1 (upper byte)
+                    axis0_status_payload = AXIS_STATUS_TABLE[status_word & AXIS_STATUS_MASK]
+                    axis1_status_payload = AXIS_STATUS_TABLE[(status_word >> 8) & AXIS_STATUS_MASK]
                     
-                    # Publish axis-specific status
-                    self.mqtt.publish(
-                        f"stepper/stepper{self.slave_id}/axis/0/status",
-                        json.dumps(axis0_status_dict)
-                    )
-                    
-                    self.mqtt.publish(
-                        f"stepper/stepper{self.slave_id}/axis/1/status",
-                        json.dumps(axis1_status_dict)
-                    )
+                    # Update connection status
+                    self.status = {
+                        "slave_id": slave_id,
+                        "connected": True,
+                        "error": "Error detected" if status_word & AXIS_ERROR_MASK else None
+                    }
                     
-                    # Publish position data for each axis individually
-                    self.mqtt.publish(
-                        f"stepper/stepper{self.slave_id}/axis/0/position",
-                        json.dumps({"position": self.positions["axis_0"]})
-                    )
-                    
-                    self.mqtt.publish(
-                        f"stepper/stepper{self.slave_id}/axis/1/position",
-                        json.dumps({"position": self.positions["axis_1"]})
+                    # Reassemble the low/high register pairs into signed 32-bit positions in one unpack
+                    position0, position1 = unpack_positions(
+                        pack_position_registers(*regs[AXIS0_POSITION_OFFSET:AXIS1_POSITION_OFFSET + 2])
                     )
+                    self.positions = {"axis_0": position0, "axis_1": position1}
                     
+                    # Log every 10th poll to avoid spam
+                    if self.debug_modbus and poll_count % 10 == 0 and logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Status Word: 0x%04X, Axis0: %s, Axis1: %s",
+                                     status_word, axis0_status_payload, axis1_status_payload)
+                        logger.debug("Position axis_0: %d, axis_1: %d", position0, position1)
+                else:
+                    # Default values if read fails
+                    status_word = 0
+                    axis0_status_payload = self._DEFAULT_AXIS_STATUS_JSON
+                    axis1_status_payload = self._DEFAULT_AXIS_STATUS_JSON
+                
+                # Publish one combined state message per axis, skipping states unchanged since the last poll.
+                # Retained, so late subscribers get the last state immediately; QoS 0 since it is a stream.
+                positions = self.positions
+                if self.publish_json:
+                    for axis, status_payload in enumerate((axis0_status_payload, axis1_status_payload)):
+                        state_payload = AXIS_STATE_TEMPLATE % (status_payload, positions[POSITION_KEYS[axis]])
+                        if state_payload != last_state_payload[axis]:
+                            last_state_payload[axis] = state_payload
+                            publish(topic_axis_state[axis], state_payload, qos=0, retain=True)
+                
+                # Compact binary state of the whole device, published the same way
+                state_bin = pack_state_bin(status_word, positions["axis_0"], positions["axis_1"])
+                if state_bin != self._last_state_bin:
+                    self._last_state_bin = state_bin
+                    publish(topic_state_bin, state_bin, qos=0, retain=True)
 
-                    
             except Exception as e:
-                logger.exception(f"Error polling status: {e}")
-                self.status["connected"] = False
+                logger.exception("Error polling status: %s", e)
+                self.status = dict(self.status, connected=False)
                 
                 # Try to reconnect if disconnected
-                if not self.modbus.is_connected():
+                connected = bus_call(self.modbus.is_connected).result()
+                if not connected:
                     logger.warning("Modbus connection lost. Attempting to reconnect...")
-                    self.status["connected"] = self.modbus.connect()
-                    if self.status["connected"]:
+                    connected = bus_call(self.modbus.connect).result()
+                    self.status = dict(self.status, connected=connected)
+                    if connected:
                         logger.info("Reconnected to Modbus device")
                     else:
                         logger.error("Failed to reconnect to Modbus device")
             
-            # Sleep for the polling interval
-            time.sleep(self.poll_interval)
+            # Sleep until the next poll is due
+            next_deadline += self.poll_interval
+            now = monotonic()
+            if now - next_deadline > self.poll_interval:
+                # More than one interval behind: start over from now rather than polling back-to-back to catch up
+                next_deadline = now
+            time.sleep(max(0.0, next_deadline - now))
         
         logger.info("Status polling thread stopped")
 
-    class Axis:
-        def __init__(self, parent, axis_id: int):
-            self.parent = parent
-            self.axis_id = axis_id
-        
-        def _move_absolute(self, params):
-            """Move axis to absolute position"""
-            target = params.get('position', 0)
-            target_low = target & 0xFFFF
-            target_high = (target >> 16) & 0xFFFF
-            speed = params.get('speed', 1000)
-            accel = params.get('acceleration', 1000)
-            decel = params.get('deceleration', 1000)
-            
-            logger.info(f"Moving axis {self.axis_id} to absolute position {target} at speed {speed}")
-            
-            with self.parent.lock:
-                # Register 0: Command register (2 = absolute move)
-                # Register 1: Target position
-                # Register 2: Speed
-                # Register 3: Acceleration
-                result = self.parent.modbus.write_registers(
-                    0,  # Starting address
-                    [0x0102, self.axis_id, target_low, target_high, 0, 0, speed, accel, decel],  # Values
-                    self.parent.slave_id
-                )
-                
-                if self.parent.debug_modbus:
-                    logger.debug(f"Modbus write result: {result}")
-                
-                # Publish acknowledgment
-                self.parent.mqtt.publish(
-                    f"stepper/stepper{self.parent.slave_id}/axis/{self.axis_id}/ack",
-                    json.dumps({
-                        "command": "move_absolute",
-                        "success": result,
-                        "params": {
-                            "target": target,
-                            "speed": speed,
-                            "accel": accel,
-                            "decel": decel
-                        }
-                    })
-                )
-                
-                return result
-        
-        def _move_relative(self, params):
-            """Move axis by relative distance"""
-            distance = params.get('distance', 0)
-            speed = params.get('speed', 1000)
-            accel = params.get('acceleration', 1000)
-            decel = params.get('deceleration', 1000)
-            
-            logger.info(f"Moving axis {self.axis_id} by relative distance {distance} at speed {speed}")
-            
-            with self.parent.lock:
-                # Register 0: Command register (3 = relative move)
-                # Register 1: Distance
-                # Register 2: Speed
-                # Register 3: Acceleration
-                result = self.parent.modbus.write_multiple_registers( 
-                    0,  # Starting address
-                    [3, distance, speed, accel, decel],
-                    self.parent.slave_id  # Values
-                )
-                
-                if self.parent.debug_modbus:
-                    logger.debug(f"Modbus write result: {result}")
-                
-                # Publish acknowledgment
-                self.parent.mqtt.publish(
-                    f"stepper/stepper{self.parent.slave_id}/axis/{self.axis_id}/ack",
-                    json.dumps({
-                        "command": "move_relative",
-                        "success": result,
-                        "params": {
-                            "distance": distance,
-                            "speed": speed,
-                            "accel": accel,
-                            "decel": decel
-                        }
-                    })
-                )
-                
-                return result
-        
-        def _home_axis(self,  params):
-            """Home the specified axis"""
-            direction = params.get('direction', 1)
-            speed = params.get('speed', 500)
-            
-            logger.info(f"Homing axis {self.axis_id} in direction {direction} at speed {speed}")
-            
-            with self.parent.lock:
-                # Register 0: Command register (1 = home)
-                # speed and direction are saved on the device
-                result = self.parent.modbus.write_register(
-                    self.parent.slave_id, 
-                    0,  # Starting address
-                    1  # Value
-                )
-                
-                if self.parent.debug_modbus:
-                    logger.debug(f"Modbus write result: {result}")
-                
-                # Publish acknowledgment
-                self.parent.mqtt.publish(
-                    f"stepper/stepper{self.parent.slave_id}/axis/{self.axis_id}/ack",
-                    json.dumps({
-                        "command": "home",
-                        "success": result
-                    })
-                )
-                
-                return result
-        
-        def _stop_axis(self):
-            """Stop the specified axis"""
-            logger.info(f"Stopping axis {self.axis_id}")
-            
-            with self.parent.lock:
-                # Register 0: Command register (0 = stop)
-                result = self.parent.modbus.write_register(
-                    self.parent.slave_id, 
-                    0,  # Address
-                    0   # Value (stop command)
-                )
-                
-                if self.parent.debug_modbus:
-                    logger.debug(f"Modbus write result: {result}")
-                
-                # Publish acknowledgment
-                self.parent.mqtt.publish(
-                    f"stepper/stepper{self.parent.slave_id}/axis/{self.axis_id}/ack",
-                    json.dumps({
-                        "command": "stop",
-                        "success": result
-                    })
-                )
-                
-                return result
-        
-        def _enable_axis(self):
-            """Enable the specified axis"""
-            logger.info(f"Enabling axis {self.axis_id}")
-            
-            with self.parent.lock:
-                # Register 4: Control register (bit 0 = enable)
-                result = self.parent.modbus.write_register(
-                    self.parent.slave_id, 
-                    4,  # Address
-                    1   # Value (enable)
-                )
-                
-                if self.parent.debug_modbus:
-                    logger.debug(f"Modbus write result: {result}")
-                
-                # Publish acknowledgment
-                self.parent.mqtt.publish(
-                    f"stepper/stepper{self.parent.slave_id}/axis/{self.axis_id}/ack",
-                    json.dumps({
-                        "command": "enable",
-                        "success": result
-                    })
-                )
-                
-                return result
-        
-        def _disable_axis(self):
-            """Disable the specified axis"""
-            logger.info(f"Disabling axis {self.axis_id}")
-            
-            with self.parent.lock:
-                # Register 4: Control register (bit 0 = enable)
-                result = self.parent.modbus.write_register(
-                    self.parent.slave_id, 
-                    4,  # Address
-                    0   # Value (disable)
-                )
-                
-                if self.parent.debug_modbus:
-                    logger.debug(f"Modbus write result: {result}")
-                
-                # Publish acknowledgment
-                self.parent.mqtt.publish(
-                    f"stepper/stepper{self.parent.slave_id}/axis/{self.axis_id}/ack",
-                    json.dumps({
-                        "command": "disable",
-                        "success": result
-                    })
-                )
-                
-                return result
-        
-        def _reset_axis(self):
-            """Reset the specified axis"""
-            logger.info(f"Resetting axis {self.axis_id}")
-            
-            with self.parent.lock:
-                # Register 5: Reset register
-                result = self.parent.modbus.write_register(
-                    self.parent.slave_id, 
-                    5,  # Address
-                    1   # Value (reset)
-                )
-                
-                if self.parent.debug_modbus:
-                    logger.debug(f"Modbus write result: {result}")
-                
-                # Publish acknowledgment
-                self.parent.mqtt.publish(
-                    f"stepper/stepper{self.parent.slave_id}/axis/{self.axis_id}/ack",
-                    json.dumps({
-                        "command": "reset",
-                        "success": result
-                    })
-                )
-                
-                return result
-
-        def _enable_servo_mode(self, params):
-            """Enable servo mode for this axis"""
-            logger.info(f"Enabling servo mode for axis {self.axis_id}")
-            
-            # Extract parameters
-            max_speed = params.get('max_speed', 5000)
-            accel = params.get('acceleration', 1000)
-            
-            with self.parent.lock:
-                # Register 0: Command register (0x0201 = enable servo mode)
-                # Register 1: Axis ID
-                # Register 2: Max speed
-                # Register 3: Acceleration
-                result = self.parent.modbus.write_registers(
-                    0,  # Starting address
-                    [0x0201, self.axis_id, max_speed, accel],  # Values
-                    self.parent.slave_id
-                )
-                
-                if self.parent.debug_modbus:
-                    logger.debug(f"Modbus write result: {result}")
-                
-                # Publish acknowledgment
-                self.parent.mqtt.publish(
-                    f"stepper/stepper{self.parent.slave_id}/axis/{self.axis_id}/ack",
-                    json.dumps({
-                        "command": "enable_servo_mode",
-                        "success": result,
-                        "params": {
-                            "max_speed": max_speed,
-                            "acceleration": accel
-                        }
-                    })
-                )
-                
-                return result
-                
-        def _disable_servo_mode(self, params):
-            """Disable servo mode for this axis"""
-            logger.info(f"Disabling servo mode for axis {self.axis_id}")
-            
-            with self.parent.lock:
-                # Register 0: Command register (0x0202 = disable servo mode)
-                # Register 1: Axis ID
-                result = self.parent.modbus.write_registers(
-                    0,  # Starting address
-                    [0x0202, self.axis_id],  # Values
-                    self.parent.slave_id
-                )
-                
-                if self.parent.debug_modbus:
-                    logger.debug(f"Modbus write result: {result}")
-                
-                # Publish acknowledgment
-                self.parent.mqtt.publish(
-                    f"stepper/stepper{self.parent.slave_id}/axis/{self.axis_id}/ack",
-                    json.dumps({
-                        "command": "disable_servo_mode",
-                        "success": result
-                    })
-                )
-                
-                return result
-                
-        def _set_servo_speed(self, params):
-            """Set speed in servo mode for this axis"""
-            # Extract speed parameter
-            speed = params.get('speed', 0)
-            
-            # Convert to signed integer if needed
-            if isinstance(speed, int):
-                # Already an integer, no conversion needed
-                pass
-            elif isinstance(speed, float):
-                # Convert float to integer
-                speed = int(speed)
-            elif isinstance(speed, str):
-                # Try to convert string to integer
-                try:
-                    speed = int(float(speed))
-                except ValueError:
-                    logger.error(f"Invalid speed value: {speed}")
-                    return False
-            
-            logger.info(f"Setting servo speed for axis {self.axis_id} to {speed}")
-            
-            with self.parent.lock:
-                # Register 0: Command register (0x0203 = set servo speed)
-                # Register 1: Axis ID
-                # Register 2: Speed (signed integer)
-                result = self.parent.modbus.write_registers(
-                    0,  # Starting address
-                    [0x0203, self.axis_id, speed],  # Values
-                    self.parent.slave_id
-                )
-                
-                if self.parent.debug_modbus:
-                    logger.debug(f"Modbus write result: {result}")
-                
-                # Publish acknowledgment
-                self.parent.mqtt.publish(
-                    f"stepper/stepper{self.parent.slave_id}/axis/{self.axis_id}/ack",
-                    json.dumps({
-                        "command": "set_servo_speed",
-                        "success": result,
-                        "params": {
-                            "speed": speed
-                        }
-                    })
-                )
-                
-                return result
-
 # Example usage
 if __name__ == "__main__":
     # Configure logging
@@ -906,6 +1140,11 @@ if __name__ == "__main__":
         poll_interval=1.0
     )
     
+    # Ctrl+C (or a service manager's SIGTERM) sets the event; the main thread sleeps in the kernel until then
+    shutdown = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: shutdown.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown.set())
+    
     try:
         if controller.start():
             logger.info("Controller started successfully")
@@ -914,10 +1153,7 @@ if __name__ == "__main__":
             controller.set_debug(mqtt_debug=True, modbus_debug=False)
             
             # Keep running until interrupted
-            while True:
-                time.sleep(1)
-                
-    except KeyboardInterrupt:
-        logger.info("Shutting down controller...")
+            shutdown.wait()
+            logger.info("Shutting down controller...")
     finally:
-        controller.stop() 
+        controller.stop()